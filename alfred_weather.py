@@ -1,16 +1,33 @@
 #!/usr/bin/env python
 # coding=UTF-8
 
-import forecastio
-import glocation
+# Provider modules (and requests), pytz and the transport layer are imported
+# where they're used so that commands that don't need them start quickly.
+import archive
+import comfort
+import compare
+import feedback
+import forecastdiff
+import functools
+import fuzzy
+import gazetteer
+import glob
+import hashlib
+import iconset
+import importlib
 import json
+import lazyjson
 import os
 import os.path
 import re
+import rules
+import singleflight
+import snapshot
+import spatial
+import sys
 import time
+import tztable
 import urlparse
-import wunderground
-import pytz
 import logging
 from datetime import date, datetime, timedelta, tzinfo
 from jcalfred import Workflow, Item, JsonFile, Menu, Command
@@ -23,13 +40,13 @@ SERVICES = {
         'name': 'Weather Underground',
         'url': 'http://www.wunderground.com',
         'getkey': 'http://www.wunderground.com/weather/api/',
-        'lib': wunderground
+        'lib': 'wunderground'
     },
     'fio': {
         'name': 'Forecast.io',
         'url': 'http://forecast.io',
         'getkey': 'https://developer.forecast.io/register',
-        'lib': forecastio
+        'lib': 'forecastio'
     }
 }
 
@@ -39,8 +56,31 @@ DEFAULT_ICONS = 'grzanka'
 DEFAULT_TIME_FMT = '%Y-%m-%d %H:%M'
 EXAMPLE_ICON = 'tstorms'
 TIMESTAMP_FMT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_SNAPSHOT = '~/jc-weather-cache.gz'
+CACHE_TTL = 300
+CACHE_MAX_AGE = 86400
+# seconds allowed for the network lookups behind one query
+FETCH_DEADLINE = 20
 LINE = unichr(0x2500) * 20
 
+# Rendered results for these commands are remembered per normalized query
+SESSION_COMMANDS = ('weather',)
+SESSION_TTL = 60
+SESSION_ERROR_TTL = 5
+SESSION_MAX_AGE = 3600
+REFRESH_TIMEOUT = 30
+REFRESH_INTERVAL = 0.3
+
+# At most this many memoized handler results are kept
+RESULTS_MAX = 200
+
+# At most this many previously chosen locations are remembered
+RECENT_LOCATIONS = 10
+
+# Settings that change how a remembered result would be rendered
+SESSION_SETTINGS = ('service', 'units', 'icons', 'time_format', 'days',
+                    'show_localtime', 'feelslike', 'location', 'rules')
+
 TIME_FORMATS = (
     DEFAULT_TIME_FMT,
     '%A, %B %d, %Y %I:%M%p',
@@ -58,6 +98,28 @@ FIO_TO_WUND = {
     'wind': 'hazy',
 }
 
+# Values used when a setting hasn't been stored; these are never written to
+# the config file unless the user explicitly changes them.
+CONFIG_DEFAULTS = {
+    'units': DEFAULT_UNITS,
+    'icons': DEFAULT_ICONS,
+    'time_format': DEFAULT_TIME_FMT,
+    'days': 3,
+    'show_localtime': True,
+    'feelslike': False,
+    # cached forecasts for any place within this many km are reused
+    'cache_radius': 2.0,
+}
+
+# Commands that don't need the stored settings migrated and normalized
+# before they run. Everything else (the forecast cache, the provider modules
+# and pytz) is loaded by whatever first uses it, whatever the command.
+NO_SETTINGS_COMMANDS = ('about', 'cache', 'commands', 'config', 'days',
+                        'feelslike', 'format', 'icons', 'location', 'log',
+                        'open', 'options', 'rules', 'units')
+
+COPYRIGHT_ROW = feedback.ItemTemplate(title=LINE, icon='blank.png', valid=True)
+
 
 class LocalTimezone(tzinfo):
 
@@ -71,6 +133,7 @@ class LocalTimezone(tzinfo):
             self.dstoffset = self.stdoffset
         self.dstdiff = self.dstoffset - self.stdoffset
         self.zero = timedelta(0)
+        self._isdst_cache = {}
 
     def utcoffset(self, dt):
         if self._isdst(dt):
@@ -92,12 +155,14 @@ class LocalTimezone(tzinfo):
                         dt.second, dt.microsecond, tzinfo=self)
 
     def _isdst(self, dt):
-        tt = (dt.year, dt.month, dt.day,
-              dt.hour, dt.minute, dt.second,
-              dt.weekday(), 0, 0)
-        stamp = time.mktime(tt)
-        tt = time.localtime(stamp)
-        return tt.tm_isdst > 0
+        # DST never changes within a minute
+        key = (dt.year, dt.month, dt.day, dt.hour, dt.minute)
+        if key not in self._isdst_cache:
+            tt = key + (0, dt.weekday(), 0, 0)
+            stamp = time.mktime(tt)
+            tt = time.localtime(stamp)
+            self._isdst_cache[key] = tt.tm_isdst > 0
+        return self._isdst_cache[key]
 
 
 class SetupError(Exception):
@@ -112,16 +177,98 @@ def clean_str(arg):
     return arg.replace('&', '&amp;')
 
 
+def _number(value):
+    '''Return a number from a provider value, or None if it isn't one'''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def memoize_items(files=(), settings=()):
+    '''
+    Remember the items a pure tell_ handler returns for each query. Menus
+    that hand queries on to other handlers aren't pure, since the key only
+    covers what the decorated handler itself reads.
+
+    Results are kept in the workflow's results cache, keyed by the handler,
+    its arguments, the modification times of this module and of the files
+    matching some glob patterns, and the values of some settings, so a
+    result is rebuilt as soon as any of those change (including when the
+    workflow is upgraded).
+    '''
+    source = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(self, *args, **kwargs):
+            stamps = [(source, os.path.getmtime(source))]
+            for pattern in files:
+                for path in sorted(glob.glob(pattern)):
+                    stamps.append((path, os.path.getmtime(path)))
+            values = [self.config.get(name) for name in settings]
+            key_data = json.dumps([handler.__name__, args, kwargs, stamps,
+                                   values, sys.hexversion], sort_keys=True)
+            key = hashlib.md5(key_data.encode('utf-8')).hexdigest()
+
+            entry = self.results.get(key)
+            if entry is not None:
+                return [feedback.item_from_dict(d) for d in entry['items']]
+
+            items = handler(self, *args, **kwargs)
+            self._remember_results(key, items)
+            return items
+        return wrapper
+    return decorator
+
+
 LOCAL_TZ = LocalTimezone()
 
 
 class WeatherWorkflow(Workflow):
 
-    def __init__(self):
+    def __init__(self, load_settings=True):
         super(WeatherWorkflow, self).__init__()
         self.cache_file = os.path.join(self.cache_dir, 'data.json')
+        self.archive_dir = os.path.join(self.data_dir, 'archive')
+        self.lock_dir = os.path.join(self.cache_dir, 'locks')
+        self._changes = None
+        self._data_time = None
+        self._pending = {}
+        self._claims = {}
         self._cache = None
-        self._load_settings()
+        self._session = None
+        self._results = None
+        self._checks = None
+        self._rule_results = None
+        self._rules = None
+        self._geocodes = None
+        self._gazetteer = None
+        self._tz_table = None
+        self._icon_manifests = {}
+        self._indexes = {}
+        self._config = None
+        self._location = None
+        if load_settings:
+            self._load_settings()
+
+    @property
+    def config(self):
+        if getattr(self, '_config', None) is None:
+            self._config = lazyjson.LazyJsonFile(self.config_file,
+                                                 CONFIG_DEFAULTS)
+        return self._config
+
+    @config.setter
+    def config(self, value):
+        # All config access goes through the lazy, write-coalescing file, so
+        # a config object assigned by the base Workflow is ignored.
+        pass
+
+    @property
+    def location(self):
+        '''The location weather is currently being shown for'''
+        return self._location or self.config['location']
 
     @property
     def cache(self):
@@ -129,6 +276,86 @@ class WeatherWorkflow(Workflow):
             self._cache = JsonFile(self.cache_file)
         return self._cache
 
+    @property
+    def session(self):
+        '''Recently rendered results, shared between invocations'''
+        if self._session is None:
+            self._session = lazyjson.LazyJsonFile(
+                os.path.join(self.cache_dir, 'session.json'))
+        return self._session
+
+    @property
+    def results(self):
+        '''Items remembered for handlers decorated with memoize_items'''
+        if self._results is None:
+            self._results = lazyjson.LazyJsonFile(
+                os.path.join(self.cache_dir, 'results.json'))
+        return self._results
+
+    @property
+    def geocodes(self):
+        '''Locations looked up with the geocoding service, by search key'''
+        if self._geocodes is None:
+            self._geocodes = lazyjson.LazyJsonFile(
+                os.path.join(self.cache_dir, 'geocodes.json'))
+        return self._geocodes
+
+    @property
+    def gazetteer(self):
+        if self._gazetteer is None:
+            self._gazetteer = gazetteer.Gazetteer()
+        return self._gazetteer
+
+    @property
+    def tz_table(self):
+        '''Offset transitions for the saved locations' timezones'''
+        if self._tz_table is None:
+            self._tz_table = tztable.Table(
+                os.path.join(self.cache_dir, 'timezones.json'))
+        return self._tz_table
+
+    @property
+    def checks(self):
+        '''
+        When cached forecasts were last confirmed by a fetch that returned
+        the same data, so the (much larger) forecast cache doesn't have to be
+        rewritten
+        '''
+        if self._checks is None:
+            self._checks = lazyjson.LazyJsonFile(
+                os.path.join(self.cache_dir, 'checked.json'))
+        return self._checks
+
+    @property
+    def rule_results(self):
+        '''The latest results of the rules, by location'''
+        if self._rule_results is None:
+            self._rule_results = lazyjson.LazyJsonFile(
+                os.path.join(self.cache_dir, 'rules.json'))
+        return self._rule_results
+
+    @property
+    def weather_rules(self):
+        '''The configured rules; invalid ones are skipped'''
+        if self._rules is None:
+            self._rules = []
+            for text in self.config.get('rules', []):
+                try:
+                    self._rules.append(rules.parse(text))
+                except rules.RuleError:
+                    LOG.warn('ignoring invalid rule "%s"', text)
+        return self._rules
+
+    def _remember_results(self, key, items):
+        if len(self.results.data) >= RESULTS_MAX:
+            oldest = min(self.results.data,
+                         key=lambda k: self.results.data[k]['at'])
+            del self.results[oldest]
+        self.results[key] = {
+            'at': time.time(),
+            'items': [feedback.item_to_dict(i) for i in items]
+        }
+
     def _localize_time(self, dtime=None):
         '''
         Return a datetime from the configured location adjusted for the local
@@ -138,8 +365,12 @@ class WeatherWorkflow(Workflow):
         time.
         '''
         if dtime:
-            remote_tz = pytz.timezone(self.config['location']['timezone'])
-            remote_time = remote_tz.localize(dtime)
+            name = self.location['timezone']
+            try:
+                remote_time = self._timezone(name).localize(dtime)
+            except tztable.OutOfRange:
+                import pytz
+                remote_time = pytz.timezone(name).localize(dtime)
             return remote_time.astimezone(LOCAL_TZ)
         else:
             return LOCAL_TZ.localize(datetime.now())
@@ -152,15 +383,40 @@ class WeatherWorkflow(Workflow):
         If no time is specified, return an instance of the current time in the
         remote location's timezone.
         '''
-        remote_tz = pytz.timezone(self.config['location']['timezone'])
-        if dtime:
-            local_time = LOCAL_TZ.localize(dtime)
-            return local_time.astimezone(remote_tz)
-        else:
-            now = LOCAL_TZ.localize(datetime.now())
-            return now.astimezone(remote_tz)
+        name = self.location['timezone']
+        local_time = LOCAL_TZ.localize(dtime or datetime.now())
+        try:
+            return local_time.astimezone(self._timezone(name))
+        except tztable.OutOfRange:
+            import pytz
+            return local_time.astimezone(pytz.timezone(name))
+
+    def _timezone(self, name):
+        '''
+        Return a tzinfo for a timezone, from the timezone table if it has it
+        '''
+        zone = self.tz_table.zone(name)
+        if zone is None and name == (self.config.get('location') or
+                                     {}).get('timezone'):
+            # the table is missing or out of date
+            self._update_tz_table()
+            zone = self.tz_table.zone(name)
+        if zone is None:
+            import pytz
+            return pytz.timezone(name)
+        return zone
+
+    def _update_tz_table(self):
+        '''Rebuild the timezone table for the saved locations'''
+        locations = ([self.config.get('location')] +
+                     self.config.get('recent_locations', []))
+        names = [l['timezone'] for l in locations if l and 'timezone' in l]
+        tztable.write(self.tz_table.path, tztable.build(names))
+        self._tz_table = None
 
     def _migrate_settings(self):
+        import glocation
+
         if 'units' in self.config:
             if self.config['units'] == 'US':
                 self.config['units'] = 'us'
@@ -189,31 +445,34 @@ class WeatherWorkflow(Workflow):
             location = self.config['location']
             tz = glocation.timezone(location['latitude'],
                                     location['longitude'])
-            self.config['location']['timezone'] = tz['timeZoneId']
+            location['timezone'] = tz['timeZoneId']
+            self.config['location'] = location
 
     def _load_settings(self):
         '''Get an the location and units to use'''
         version = self.config.get('version')
-        if version is not None and version < SETTINGS_VERSION:
-            self._migrate_settings()
-
-        self.config['version'] = SETTINGS_VERSION
-        self.config['units'] = self.config.get('units', DEFAULT_UNITS)
-        self.config['icons'] = self.config.get('icons', DEFAULT_ICONS)
-        self.config['time_format'] = self.config.get('time_format',
-                                                     DEFAULT_TIME_FMT)
-        self.config['days'] = self.config.get('days', 3)
-        self.config['show_localtime'] = self.config.get('show_localtime', True)
-
-        import os.path
-        old_config_file = os.path.join(self.data_dir, 'settings.json')
-        if (os.path.exists(old_config_file) and not
-                self.config.get('migrated')):
-            old_config = JsonFile(old_config_file)
-            for key, value in old_config.items():
-                self.config[key] = value
+        if version is None or version < SETTINGS_VERSION:
+            if version is not None:
+                self._migrate_settings()
+            self.config['version'] = SETTINGS_VERSION
+
+        # once the legacy settings file has been handled there's no need to
+        # look for it again
+        if not self.config.get('migrated'):
+            old_config_file = os.path.join(self.data_dir, 'settings.json')
+            if os.path.exists(old_config_file):
+                old_config = JsonFile(old_config_file)
+                for key, value in old_config.items():
+                    self.config[key] = value
             self.config['migrated'] = True
 
+        # the Forecast.io code once read the feels-like setting under its own
+        # name
+        if 'show-feelslike' in self.config:
+            if 'feelslike' not in self.config.data:
+                self.config['feelslike'] = self.config['show-feelslike']
+            del self.config['show-feelslike']
+
     def _validate_settings(self):
         try:
             if 'service' not in self.config:
@@ -235,45 +494,324 @@ class WeatherWorkflow(Workflow):
 
     def _update_location(self, query):
         '''Temporarily update the location to a new value'''
-        location = glocation.geocode(query)
-        name = location['name']
-        short_name = name.partition(',')[0] if ',' in name else name
-        tz = glocation.timezone(location['latitude'], location['longitude'])
-        temp_loc = {
-            'name': name,
-            'short_name': short_name,
-            'latitude': location['latitude'],
-            'longitude': location['longitude'],
-            'timezone': tz['timeZoneId']
+        self._location = self._resolve_locations([query])[0]
+
+    def _resolve_locations(self, queries):
+        '''
+        Look up the locations for several queries at once.
+
+        Places in the bundled gazetteer or that have been looked up before
+        are resolved locally; the rest are geocoded together, and forecasts
+        for the resolved locations are requested while their timezones are
+        being looked up.
+        '''
+        deadline = time.time() + FETCH_DEADLINE
+        locations = [self._local_location(q) for q in queries]
+        self._prefetch([l for l in locations if l], deadline)
+
+        misses = [q for q, l in zip(queries, locations) if l is None]
+        if misses:
+            found = iter(self._geocode_locations(misses, deadline))
+            locations = [l or next(found) for l in locations]
+        return locations
+
+    def _local_location(self, query):
+        '''
+        Return a location for a query from the bundled gazetteer or from an
+        earlier geocoding lookup, or None if it isn't known locally
+        '''
+        key = gazetteer.search_key(query)
+        if key in self.geocodes:
+            return self.geocodes[key]
+
+        city = self.gazetteer.lookup(query)
+        if city is None:
+            return None
+        return {
+            'name': gazetteer.display_name(city),
+            'short_name': city.name,
+            'latitude': city.latitude,
+            'longitude': city.longitude,
+            'timezone': city.timezone
         }
-        self.config['location'].update(temp_loc)
 
-    def _load_cached_data(self, service, location):
-        data = None
+    def _geocode_locations(self, queries, deadline):
+        '''Look up locations with the geocoding service and remember them'''
+        import glocation
+        import transport
 
-        if service not in self.cache:
-            self.cache[service] = {'forecasts': {}}
+        geocodes = transport.gather([glocation.geocode_async(q, deadline)
+                                     for q in queries])
+        timezones = [glocation.timezone_async(g['latitude'], g['longitude'],
+                                              deadline)
+                     for g in geocodes]
+        self._prefetch(geocodes, deadline)
+
+        locations = []
+        for query, location, tz in zip(queries, geocodes, timezones):
+            name = location['name']
+            short_name = name.partition(',')[0] if ',' in name else name
+            locations.append({
+                'name': name,
+                'short_name': short_name,
+                'latitude': location['latitude'],
+                'longitude': location['longitude'],
+                'timezone': tz.result()['timeZoneId']
+            })
+            self.geocodes[gazetteer.search_key(query)] = locations[-1]
+        return locations
 
-        if location in self.cache[service]['forecasts']:
-            last_check = self.cache[service]['forecasts'][
-                location]['requested_at']
-            last_check = datetime.strptime(last_check, TIMESTAMP_FMT)
-            if (datetime.now() - last_check).seconds < 300:
-                data = self.cache[service]['forecasts'][location]['data']
+    def _prefetch(self, locations, deadline=None):
+        '''
+        Start fetching forecasts for locations that aren't cached. Each
+        location's single-flight lock is held until its forecast is cached
+        by _load_forecast, so other processes wait for it rather than making
+        the same request.
+        '''
+        service = self.config['service']
+        for location in locations:
+            key = '{},{}'.format(location['latitude'], location['longitude'])
+            if ((service, key) in self._pending or
+                    self._load_cached_data(service, key) is not None):
+                continue
+            claim = singleflight.claim(self.lock_dir,
+                                       '{}:{}'.format(service, key))
+            if claim is None:
+                # another process is already fetching it
+                continue
+            self._claims[(service, key)] = claim
+            self._pending[(service, key)] = self._fetch_forecast(
+                service, key, deadline)
+
+    def _fetch_forecast(self, service, location, deadline=None,
+                        conditional=True):
+        '''
+        Start fetching a forecast; returns a transport.Future for a
+        transport.Fetched. If a forecast for the location is cached, the
+        request is conditional on it having changed.
+        '''
+        lib = importlib.import_module(SERVICES[service]['lib'])
+        lib.set_key(self.config['key.' + service])
+        validators = None
+        if conditional:
+            entry = self._cache_entry(service, location)
+            validators = entry.get('validators') if entry else None
+        if service == 'wund':
+            return lib.fetch_async(location, validators, deadline)
+        else:
+            return lib.fetch_async(location, {'units': self.config['units']},
+                                   validators, deadline)
+
+    def _get_forecast(self, service, location):
+        '''
+        Get a forecast, using the result of a prefetch if one was started
+        '''
+        future = self._pending.pop((service, location), None)
+        if future is None:
+            future = self._fetch_forecast(service, location,
+                                          time.time() + FETCH_DEADLINE)
+        fetched = future.result()
+        if fetched.data is None:
+            # not modified, so the cached forecast is still current
+            entry = self._cache_entry(service, location)
+            if entry is None:
+                # it's been dropped from the cache since the request
+                return self._fetch_forecast(
+                    service, location, time.time() + FETCH_DEADLINE,
+                    conditional=False).result()
+            fetched = fetched._replace(data=entry['data'])
+        return fetched
+
+    def _load_forecast(self, service, location, usable=None):
+        '''
+        Return cached data for a location, fetching and caching it if there
+        isn't any (or if usable(data) is false).
+
+        Only one process at a time fetches data for a location. Any others
+        wait for it to finish and then use the data it cached.
+        '''
+        # a prefetch may have taken the lock when it started the request; it
+        # is released however this returns
+        claim = self._claims.pop((service, location), None)
+        try:
+            data = self._load_cached_data(service, location)
+            if data is not None and (usable is None or usable(data)):
+                return data
+            if claim is not None:
+                data, validators = self._get_forecast(service, location)
+                self._save_cached_data(service, location, data, validators)
+                return data
+        finally:
+            if claim is not None:
+                singleflight.release(claim)
+
+        key = '{}:{}'.format(service, location)
+        with singleflight.flight(self.lock_dir, key) as waited:
+            if waited:
+                self._cache = None
+                data = self._load_cached_data(service, location)
+                if data is not None and (usable is None or usable(data)):
+                    return data
+            data, validators = self._get_forecast(service, location)
+            self._save_cached_data(service, location, data, validators)
 
         return data
 
-    def _save_cached_data(self, service, location, data):
+    def _spatial_index(self, service_cache):
+        '''Return the spatial index of a service's cached forecasts'''
+        radius = self.config['cache_radius']
+        if service_cache.get('radius') != radius:
+            # the grid depends on the radius, so rebuild it if that changed
+            service_cache['radius'] = radius
+            service_cache['cells'] = {}
+            index = spatial.GridIndex(service_cache['cells'], radius)
+            for key in service_cache['forecasts']:
+                index.add(key)
+            return index
+        return spatial.GridIndex(service_cache['cells'], radius)
+
+    def _cache_entry(self, service, location):
+        '''Return the cache entry for a location, however old it is'''
+        if service not in self.cache:
+            return None
+        return self.cache[service]['forecasts'].get(location)
+
+    def _cache_time(self, entry):
+        return datetime.strptime(entry['requested_at'], TIMESTAMP_FMT)
+
+    def _max_age(self, entry):
+        '''Return how many seconds a cached forecast stays fresh'''
+        max_age = (entry.get('validators') or {}).get('max_age')
+        return CACHE_TTL if max_age is None else max_age
+
+    def _entry_time(self, service, key, entry):
+        '''Return the last time a cached forecast was known to be current'''
+        requested_at = self._cache_time(entry)
+        checked_at = self.checks.get('{}:{}'.format(service, key))
+        if checked_at:
+            return max(requested_at,
+                       datetime.strptime(checked_at, TIMESTAMP_FMT))
+        return requested_at
+
+    def _load_cached_data(self, service, location):
+        '''
+        Return fresh cached data for a location, or for the nearest location
+        within the cache radius that has some.
+        '''
         if service not in self.cache:
-            self.cache[service] = {'forecasts': {}}
+            return None
+
         service_cache = self.cache[service]
-        service_cache['forecasts'][location] = {
-            'requested_at': datetime.now().strftime(TIMESTAMP_FMT),
+        forecasts = service_cache['forecasts']
+        candidates = [(0, location)] if location in forecasts else []
+        if self.config['cache_radius'] > 0:
+            lat, lng = spatial.parse_key(location)
+            candidates += self._spatial_index(service_cache).nearby(lat, lng)
+
+        for dist, key in candidates:
+            entry = forecasts.get(key)
+            if not entry:
+                continue
+            requested_at = self._entry_time(service, key, entry)
+            age = (datetime.now() - requested_at).total_seconds()
+            if age < self._max_age(entry):
+                if key != location:
+                    LOG.debug('using cached data for %s (%.1f km away)',
+                              key, dist)
+                self._data_time = requested_at
+                return entry['data']
+
+        return None
+
+    def _save_cached_data(self, service, location, data, validators=None):
+        # other processes may have updated the cache since it was loaded, so
+        # reload it before making changes
+        with singleflight.flight(self.lock_dir, self.cache_file):
+            self._cache = None
+            self.checks.reload()
+            self._update_cached_data(service, location, data, validators)
+            self.checks.flush()
+
+    def _update_cached_data(self, service, location, data, validators=None):
+        '''
+        Cache newly fetched data for a location, with the validators for
+        revalidating it. If it's the same as the data already cached, only
+        the time it was confirmed is recorded.
+        '''
+        if service in self.cache:
+            service_cache = self.cache[service]
+        else:
+            service_cache = {'forecasts': {}}
+        forecasts = service_cache['forecasts']
+        now = datetime.now()
+        check_key = '{}:{}'.format(service, location)
+
+        normalized = forecastdiff.normalize(service, data)
+        digest = forecastdiff.digest(normalized)
+        old = forecasts.get(location)
+        if old and old.get('digest') == digest:
+            LOG.debug('forecast for %s is unchanged', location)
+            self.checks[check_key] = now.strftime(TIMESTAMP_FMT)
+            if old.get('validators') != validators:
+                old['validators'] = validators
+                self.cache[service] = service_cache
+            self._data_time = now.replace(microsecond=0)
+            self._changes = []
+            return
+
+        old_data = forecastdiff.normalize(service, old['data']) if old else {}
+        self._changes = forecastdiff.changes(old_data, normalized)
+        LOG.debug('forecast for %s changed: %s', location,
+                  ', '.join(self._changes))
+
+        # forget forecasts that are too old to ever be used again
+        index = self._spatial_index(service_cache)
+        for key, entry in forecasts.items():
+            age = now - self._entry_time(service, key, entry)
+            if age.total_seconds() > CACHE_MAX_AGE:
+                del forecasts[key]
+                index.remove(key)
+                if '{}:{}'.format(service, key) in self.checks:
+                    del self.checks['{}:{}'.format(service, key)]
+
+        forecasts[location] = {
+            'requested_at': now.strftime(TIMESTAMP_FMT),
+            'digest': digest,
+            'validators': validators,
             'data': data
         }
+        if check_key in self.checks:
+            del self.checks[check_key]
+        index.add(location)
         self.cache[service] = service_cache
+        self._data_time = self._cache_time(forecasts[location])
+
+    def _archive_weather(self, weather):
+        '''Add newly fetched weather to the history archive'''
+        try:
+            archive.record(self.archive_dir, self.location['latitude'],
+                           self.location['longitude'], weather,
+                           self.config['units'])
+        except Exception:
+            LOG.exception('Error archiving weather')
+
+    def _icon_manifest(self, iset):
+        '''Return the manifest of an icon set, or None if it has none'''
+        if iset not in self._icon_manifests:
+            self._icon_manifests[iset] = iconset.load_manifest(
+                os.path.join('icons', iset))
+        return self._icon_manifests[iset]
 
     def _get_icon(self, name):
+        manifest = self._icon_manifest(self.config['icons'])
+        if manifest is not None:
+            for candidate in (name, name[3:] if name.startswith('nt_')
+                              else None, 'default'):
+                if candidate in manifest:
+                    return 'icons/{}/{}'.format(self.config['icons'],
+                                                manifest[candidate])
+            return 'error.png'
+
         icon = 'icons/{}/{}.png'.format(self.config['icons'], name)
         if not os.path.exists(icon):
             if name.startswith('nt_'):
@@ -287,6 +825,30 @@ class WeatherWorkflow(Workflow):
             icon = '{}.png'.format('error')
         return icon
 
+    def _fuzzy_match(self, query, entries):
+        '''
+        Return the values of a list of (text, value) entries whose text
+        matches a query, best match first
+        '''
+        key = tuple(text for text, value in entries)
+        if key not in self._indexes:
+            self._indexes[key] = fuzzy.FuzzyIndex(
+                (text, i) for i, (text, value) in enumerate(entries))
+        return [entries[i][1] for i in self._indexes[key].search(query)]
+
+    def _rank_menu(self, entries, query):
+        '''
+        Build a menu structure from (class, name, description) entries with
+        the entries best matching a query first. Once a menu entry has been
+        chosen the order is left alone.
+        '''
+        if ' ' not in query.strip():
+            ranked = self._fuzzy_match(query, [
+                (u'{} {}'.format(name, desc), (cls, name, desc))
+                for cls, name, desc in entries])
+            entries = ranked + [e for e in entries if e not in ranked]
+        return [cls(name, desc) for cls, name, desc in entries]
+
     def _get_today_word(self, sunset):
         # the 'today' word is 'tonight' if it's less than 2 hours before sunset
         current_time = self._localize_time()
@@ -311,23 +873,91 @@ class WeatherWorkflow(Workflow):
         if len(location) > 0:
             self._update_location(location)
 
+        return self._get_location_weather()
+
+    def _get_location_weather(self):
+        '''Get the weather for the current location'''
+        self._changes = None
         if self.config['service'] == 'wund':
             weather = self._get_wund_weather()
         else:
             weather = self._get_fio_weather()
+        self._add_comfort(weather)
+        self._check_rules(weather)
+
+        # only forecasts that say something new are worth keeping
+        if self._changes:
+            self._archive_weather(weather)
 
         return weather
 
+    def _add_comfort(self, weather):
+        '''
+        Add how the current conditions and each day's high and low feel, and
+        the current dew point, to normalized weather
+        '''
+        units = self.config['units']
+        current = weather['current']
+        current['feelslike'] = comfort.apparent_temperature(
+            current['temp'], current.get('humidity'), current.get('wind'),
+            units=units)
+        current['dew_point'] = comfort.dew_point(
+            current['temp'], current.get('humidity'), units=units)
+
+        days = weather['forecast']
+        humidity = [d.get('humidity') for d in days]
+        wind = [d.get('wind') for d in days]
+        for kind in ('hi', 'lo'):
+            temps = [_number(d['temp_' + kind]) for d in days]
+            feels = comfort.apparent_temperature(temps, humidity, wind,
+                                                 units=units)
+            for day, temp in zip(days, feels):
+                day['feelslike_' + kind] = (int(round(temp))
+                                            if temp is not None else None)
+
+    def _check_rules(self, weather):
+        '''Evaluate the rules about the current location'''
+        if not self.weather_rules:
+            return
+        context = {'service': self.config['service'],
+                   'units': self.config['units']}
+        rules.update(self.rule_results, self.weather_rules, self.location,
+                     self.config.get('location'), weather['forecast'],
+                     context)
+
+    def check_rules(self):
+        '''
+        Evaluate the rules for every location they're about, fetching the
+        forecasts that aren't cached
+        '''
+        self._validate_settings()
+        named = sorted(set(r.location for r in self.weather_rules
+                           if r.location))
+        locations = self._resolve_locations(named) if named else []
+        if any(r.location is None for r in self.weather_rules):
+            locations.insert(0, self.config['location'])
+        self._prefetch(locations, time.time() + FETCH_DEADLINE)
+
+        for location in locations:
+            self._location = location
+            try:
+                self._get_location_weather()
+            except Exception:
+                LOG.exception('Error checking rules for %s',
+                              location['name'])
+        self._location = None
+
+    def _service_lib(self):
+        '''Return the module for the configured weather service'''
+        return importlib.import_module(SERVICES[self.config['service']]['lib'])
+
     def _get_wund_weather(self):
-        LOG.debug('getting weather from Weather Underground')
-        location = '{},{}'.format(self.config['location']['latitude'],
-                                  self.config['location']['longitude'])
-        data = self._load_cached_data('wund', location)
+        import wunderground
 
-        if data is None:
-            wunderground.set_key(self.config['key.wund'])
-            data = wunderground.forecast(location)
-            self._save_cached_data('wund', location, data)
+        LOG.debug('getting weather from Weather Underground')
+        location = '{},{}'.format(self.location['latitude'],
+                                  self.location['longitude'])
+        data = self._load_forecast('wund', location)
 
         def parse_alert(alert):
             data = {'description': alert['description']}
@@ -346,8 +976,8 @@ class WeatherWorkflow(Workflow):
                         SERVICES['wund']['url'], zone['state'], zone['ZONE'])
                 except:
                     location = '{},{}'.format(
-                        self.config['location']['latitude'],
-                        self.config['location']['longitude'])
+                        self.location['latitude'],
+                        self.location['longitude'])
                     data['uri'] = wunderground.get_forecast_url(location)
             return data
 
@@ -357,9 +987,7 @@ class WeatherWorkflow(Workflow):
             weather['alerts'] = [parse_alert(a) for a in data['alerts']]
 
         conditions = data['current_observation']
-        weather['info']['time'] = datetime.strptime(
-            self.cache['wund']['forecasts'][location]['requested_at'],
-            TIMESTAMP_FMT)
+        weather['info']['time'] = self._data_time
 
         if 'moon_phase' in data:
             def to_time(time_dict):
@@ -380,20 +1008,18 @@ class WeatherWorkflow(Workflow):
         except:
             icon = conditions['icon']
 
-        feelslike = self.config.get('feelslike', False)
-
         weather['current'] = {
             'weather': conditions['weather'],
             'icon': icon,
             'humidity': int(conditions['relative_humidity'][:-1])
         }
 
-        temp_kind = 'feelslike' if feelslike else 'temp'
-
         if self.config['units'] == 'us':
-            weather['current']['temp'] = float(conditions[temp_kind + '_f'])
+            weather['current']['temp'] = float(conditions['temp_f'])
+            weather['current']['wind'] = conditions.get('wind_mph')
         else:
-            weather['current']['temp'] = float(conditions[temp_kind + '_c'])
+            weather['current']['temp'] = float(conditions['temp_c'])
+            weather['current']['wind'] = conditions.get('wind_kph')
 
         days = data['forecast']['simpleforecast']['forecastday']
 
@@ -406,14 +1032,18 @@ class WeatherWorkflow(Workflow):
                 'precip': day['pop'],
                 'icon': day['icon'],
                 'date': fdate,
+                'humidity': day.get('avehumidity'),
             }
 
+            wind = day.get('avewind', {})
             if self.config['units'] == 'us':
                 info['temp_hi'] = day['high']['fahrenheit']
                 info['temp_lo'] = day['low']['fahrenheit']
+                info['wind'] = wind.get('mph')
             else:
                 info['temp_hi'] = day['high']['celsius']
                 info['temp_lo'] = day['low']['celsius']
+                info['wind'] = wind.get('kph')
 
             return info
 
@@ -428,15 +1058,11 @@ class WeatherWorkflow(Workflow):
 
     def _get_fio_weather(self):
         LOG.debug('getting weather from Forecast.io')
-        location = '{},{}'.format(self.config['location']['latitude'],
-                                  self.config['location']['longitude'])
-        data = self._load_cached_data('fio', location)
-
-        if data is None or data['flags']['units'] != self.config['units']:
-            forecastio.set_key(self.config['key.fio'])
-            units = self.config['units']
-            data = forecastio.forecast(location, params={'units': units})
-            self._save_cached_data('fio', location, data)
+        location = '{},{}'.format(self.location['latitude'],
+                                  self.location['longitude'])
+        units = self.config['units']
+        data = self._load_forecast(
+            'fio', location, lambda d: d['flags']['units'] == units)
 
         weather = {'current': {}, 'forecast': [], 'info': {}}
 
@@ -451,18 +1077,21 @@ class WeatherWorkflow(Workflow):
             weather['alerts'] = alerts
 
         conditions = data['currently']
-        weather['info']['time'] = datetime.strptime(
-            self.cache['fio']['forecasts'][location]['requested_at'],
-            TIMESTAMP_FMT)
+        weather['info']['time'] = self._data_time
 
-        feelslike = self.config.get('show-feelslike', False)
-        temp_kind = 'apparentTemperature' if feelslike else 'temperature'
+        def wind_speed(block):
+            # SI wind speeds are in m/s
+            speed = block.get('windSpeed')
+            if speed is not None and units == 'si':
+                speed *= 3.6
+            return speed
 
         weather['current'] = {
             'weather': conditions['summary'],
             'icon': FIO_TO_WUND.get(conditions['icon'], conditions['icon']),
             'humidity': conditions['humidity'] * 100,
-            'temp': float(conditions[temp_kind])
+            'temp': float(conditions['temperature']),
+            'wind': wind_speed(conditions)
         }
 
         days = data['daily']['data']
@@ -479,11 +1108,12 @@ class WeatherWorkflow(Workflow):
         def get_day_info(day):
             fdate = self._remotize_time(
                 datetime.fromtimestamp(day['time'])).date()
-            if day['summary'][-1] == '.':
-                day['summary'] = day['summary'][:-1]
+            summary = day['summary']
+            if summary[-1] == '.':
+                summary = summary[:-1]
             info = {
                 'date': fdate,
-                'conditions': day['summary'],
+                'conditions': summary,
                 'icon': FIO_TO_WUND.get(day['icon'], day['icon']),
                 'temp_hi': int(round(day['temperatureMax'])),
                 'temp_lo': int(round(day['temperatureMin'])),
@@ -495,6 +1125,9 @@ class WeatherWorkflow(Workflow):
             }
             if 'precipProbability' in day:
                 info['precip'] = 100 * day['precipProbability']
+            if 'humidity' in day:
+                info['humidity'] = 100 * day['humidity']
+            info['wind'] = wind_speed(day)
 
             return info
 
@@ -505,9 +1138,8 @@ class WeatherWorkflow(Workflow):
     def _get_copyright_info(self, weather):
         arg = SERVICES[self.config['service']]['url']
         time = weather['info']['time'].strftime(self.config['time_format'])
-        return Item(LINE, u'Fetched from {} at {}'.format(
-            SERVICES[self.config['service']]['name'], time),
-            icon='blank.png', arg=arg, valid=True)
+        return COPYRIGHT_ROW.item(subtitle=u'Fetched from {} at {}'.format(
+            SERVICES[self.config['service']]['name'], time), arg=arg)
 
     def _show_alert_information(self, weather):
         items = []
@@ -518,11 +1150,28 @@ class WeatherWorkflow(Workflow):
                     item.subtitle = 'Expires at {}'.format(
                         alert['expires'].strftime(self.config['time_format']))
                 if 'uri' in alert:
-                    item.arg = clean_str(alert['uri'])
+                    item.arg = alert['uri']
                     item.valid = True
                 items.append(item)
         return items
 
+    def _show_rule_matches(self):
+        items = []
+        if not self.weather_rules:
+            return items
+        # only the shown location's rules, within the days shown
+        found = rules.matches(self.rule_results, self.weather_rules,
+                              date.today(), CACHE_MAX_AGE,
+                              days=self.config['days'],
+                              names=[self.location['name']])
+        for rule, name, day in found:
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+            items.append(Item(u'{}: {}'.format(name, rule.text),
+                              subtitle=u'First matches the forecast for '
+                              u'{}'.format(self._get_day_desc(day)),
+                              icon='error.png'))
+        return items
+
     def _get_day_desc(self, date, today_word='Today'):
         today = self._get_current_date()
         offset = date.today() - today
@@ -541,16 +1190,167 @@ class WeatherWorkflow(Workflow):
             days = days[:self.config['days']]
         return days
 
+    def _session_key(self, name, query):
+        '''
+        Return the session cache key for a query, or None if results for the
+        command aren't remembered.
+        '''
+        if name not in SESSION_COMMANDS:
+            return None
+        query = u' '.join(query.split()).lower()
+        settings = json.dumps([self.config.get(k) for k in SESSION_SETTINGS],
+                              sort_keys=True)
+        digest = hashlib.md5(settings.encode('utf-8')).hexdigest()[:8]
+        return u'{}:{}:{}'.format(name, digest, query)
+
+    def _save_session(self, key, items, ttl=SESSION_TTL):
+        # other processes may have saved results since the session was
+        # loaded, so reload it before making changes
+        with singleflight.flight(self.lock_dir, self.session.path):
+            self.session.reload()
+            now = time.time()
+            for old_key in self.session.keys():
+                if now - self.session[old_key].get('at', 0) > SESSION_MAX_AGE:
+                    del self.session[old_key]
+            self.session[key] = {
+                'at': now,
+                'ttl': ttl,
+                'items': [feedback.item_to_dict(i) for i in items]
+            }
+            self.session.flush()
+
+    def _can_answer_quickly(self, query):
+        '''True if a query can be answered without a network request'''
+        if query.strip():
+            return False
+        if 'service' not in self.config or 'location' not in self.config:
+            return True
+        location = '{},{}'.format(self.location['latitude'],
+                                  self.location['longitude'])
+        return self._load_cached_data(self.config['service'],
+                                      location) is not None
+
+    def _start_refresh(self, name, query, key, entry):
+        '''Compute a result in a background process'''
+        with singleflight.flight(self.lock_dir, self.session.path):
+            self.session.reload()
+            entry = self.session.get(key, entry)
+            if (entry and
+                    time.time() - entry.get('pending', 0) < REFRESH_TIMEOUT):
+                return
+
+            entry = dict(entry or {'at': 0, 'items': []})
+            entry['pending'] = time.time()
+            self.session[key] = entry
+            self.session.flush()
+
+        import subprocess
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'alfred_weather.py')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.Popen([sys.executable, script, 'refresh', name, query],
+                             stdout=devnull, stderr=devnull, close_fds=True)
+
+    def _handler_items(self, name, query):
+        '''
+        Generate the items for a command, converting an error into an error
+        item. Sets self._handler_failed if that happens.
+        '''
+        self._handler_failed = False
+        handler = getattr(self, '_iter_' + name, None)
+        if handler is None:
+            handler = getattr(self, 'tell_' + name)
+
+        try:
+            for item in handler(query):
+                yield item
+        except SetupError as e:
+            self._handler_failed = True
+            yield Item(e.title, e.subtitle, icon='error.png')
+        except Exception as e:
+            self._handler_failed = True
+            LOG.exception('Error getting items for %s', name)
+            yield Item(u'Error: {}'.format(e), icon='error.png')
+
+    def refresh(self, name, query=''):
+        '''Compute a result and store it in the session cache'''
+        key = self._session_key(name, query)
+        if key is None:
+            return
+        items = list(self._handler_items(name, query))
+        # errors are only kept long enough for a polling Alfred to show them
+        ttl = SESSION_ERROR_TTL if self._handler_failed else SESSION_TTL
+        self._save_session(key, items, ttl)
+
+        if name == 'weather' and self.weather_rules:
+            # results for other locations are shown on the next run
+            try:
+                self.check_rules()
+            except Exception:
+                LOG.exception('Error checking rules')
+
+    def stream(self, name, query='', fmt=None):
+        '''
+        Like tell(), but write feedback items as the handler produces them.
+
+        A handler with an _iter_<name> generator is streamed item by item;
+        the items from any other tell_<name> handler are written when it
+        returns.
+
+        Results for SESSION_COMMANDS are remembered for SESSION_TTL seconds
+        per normalized query. With JSON feedback, a query that needs network
+        access is answered by a background process while Alfred reruns this
+        script, showing the previous result (if any) until the new one is
+        ready.
+        '''
+        writer = feedback.writer(fmt)
+        key = self._session_key(name, query)
+        entry = self.session.get(key) if key else None
+
+        if entry and time.time() - entry['at'] < entry.get('ttl', SESSION_TTL):
+            for data in entry['items']:
+                writer.write(feedback.item_from_dict(data))
+            writer.close()
+            return
+
+        # Alfred passes the variables from the previous run back when it
+        # reruns a script filter
+        last_key = os.environ.get('session_key', '').decode('utf-8')
+        polling = key and last_key == key
+        if (key and isinstance(writer, feedback.JsonWriter) and (polling or
+                not self._can_answer_quickly(query))):
+            self._start_refresh(name, query, key, entry)
+            if entry and entry['items']:
+                for data in entry['items']:
+                    writer.write(feedback.item_from_dict(data))
+            else:
+                writer.write(Item('Loading...', subtitle=u'Getting the '
+                                  'weather for {}'.format(query.strip())))
+            writer.rerun = REFRESH_INTERVAL
+            writer.variables = {'session_key': key}
+            writer.close()
+            return
+
+        items = []
+        for item in self._handler_items(name, query):
+            writer.write(item)
+            if key:
+                items.append(item)
+        if key and not self._handler_failed:
+            self._save_session(key, items)
+
+        writer.close()
+
     # commands ---------------------------------------------------------
 
     def tell_commands(self, query, prefix=None):
-        structure = [
-            Menu('options', 'Change options...'),
-            Command('about', 'Show system information'),
-            Command('config', 'Open the config file'),
-            Command('log', 'Open the debug log'),
+        entries = [
+            (Menu, 'options', 'Change options...'),
+            (Command, 'about', 'Show system information'),
+            (Command, 'config', 'Open the config file'),
+            (Command, 'log', 'Open the debug log'),
         ]
-        return self.menu(structure, query)
+        return self.menu(self._rank_menu(entries, query), query)
 
     def do_command(self, query):
         cmd, sep, arg = query.partition('|')
@@ -565,18 +1365,20 @@ class WeatherWorkflow(Workflow):
     # options ----------------------------------------------------------
 
     def tell_options(self, query, prefix=None):
-        structure = [
-            Menu('units', 'Choose your preferred unit system'),
-            Menu('location', 'Set your default location with a ZIP '
-                 'code or city name'),
-            Menu('icons', 'Choose an icon set'),
-            Menu('service', 'Select your preferred weather provider'),
-            Menu('days', 'Set the number of forecast days to show'),
-            Command('feelslike', 'Toggle whether to show "feels like" '
-                    'temperatures'),
-            Menu('format', 'Select a time format or specify your own')
+        entries = [
+            (Menu, 'units', 'Choose your preferred unit system'),
+            (Menu, 'location', 'Set your default location with a ZIP '
+             'code or city name'),
+            (Menu, 'icons', 'Choose an icon set'),
+            (Menu, 'service', 'Select your preferred weather provider'),
+            (Menu, 'days', 'Set the number of forecast days to show'),
+            (Command, 'feelslike', 'Toggle whether to show "feels like" '
+             'temperatures'),
+            (Menu, 'format', 'Select a time format or specify your own'),
+            (Menu, 'rules', 'Add or remove rules about the forecast'),
+            (Menu, 'cache', 'Export or import the forecast cache')
         ]
-        return self.menu(structure, query, 'options')
+        return self.menu(self._rank_menu(entries, query), query, 'options')
 
     # time format ------------------------------------------------------
 
@@ -584,19 +1386,29 @@ class WeatherWorkflow(Workflow):
         items = []
         now = datetime.now()
 
+        formats = list(TIME_FORMATS)
+        if self.config['time_format'] not in formats:
+            formats.append(self.config['time_format'])
+
         if fmt:
             try:
                 items.append(Item(now.strftime(fmt), arg='format|' + fmt,
                                   valid=True))
             except:
                 items.append(Item('Waiting for input...'))
+            matches = self._fuzzy_match(fmt, [
+                (u'{} {}'.format(f, now.strftime(f)), f) for f in formats])
+            for match in matches:
+                if match != fmt:
+                    items.append(Item(now.strftime(match),
+                                      arg='format|' + match, valid=True))
             items.append(Item('Python time format syntax...',
                               arg='http://docs.python.org/2/library/'
                                   'datetime.html#strftime-and-strptime-'
                                   'behavior',
                               valid=True))
         else:
-            for fmt in TIME_FORMATS:
+            for fmt in formats:
                 items.append(Item(now.strftime(fmt), arg='format|' + fmt,
                                   valid=True))
 
@@ -613,12 +1425,17 @@ class WeatherWorkflow(Workflow):
 
     # icons ------------------------------------------------------------
 
-    def tell_icons(self, ignored, prefix=None):
+    @memoize_items(files=('icons', 'icons/*/info.json',
+                          'icons/*/manifest.json'))
+    def tell_icons(self, query, prefix=None):
         items = []
         sets = [f for f in os.listdir('icons') if not f.startswith('.')]
+        sets = self._fuzzy_match(query, [(s, s) for s in sets])
         for iset in sets:
             uid = 'icons-{}'.format(iset)
-            icon = 'icons/{}/{}.png'.format(iset, EXAMPLE_ICON)
+            manifest = self._icon_manifest(iset) or {}
+            icon = 'icons/{}/{}'.format(iset, manifest.get(
+                EXAMPLE_ICON, EXAMPLE_ICON + '.png'))
             title = iset.capitalize()
             item = Item(title, uid=uid, icon=icon, arg=u'icons|' + iset,
                         valid=True)
@@ -639,6 +1456,7 @@ class WeatherWorkflow(Workflow):
 
     # days -------------------------------------------------------------
 
+    @memoize_items(settings=('days',))
     def tell_days(self, days, prefix=None):
         if len(days) == 0:
             length = '{} day'.format(self.config['days'])
@@ -672,19 +1490,13 @@ class WeatherWorkflow(Workflow):
 
     # service ----------------------------------------------------------
 
+    @memoize_items()
     def tell_service(self, query, prefix=None):
         items = []
-        query = query.strip()
-
         for svc in SERVICES.keys():
             items.append(Item(SERVICES[svc]['name'], uid=svc,
                               arg='service|' + svc, valid=True))
-
-        if len(query) > 0:
-            q = query.lower()
-            items = [i for i in items if q in i.title.lower()]
-
-        return items
+        return self._fuzzy_match(query, [(i.title, i) for i in items])
 
     def do_service(self, svc):
         self.config['service'] = svc
@@ -705,6 +1517,7 @@ class WeatherWorkflow(Workflow):
 
     # units ------------------------------------------------------------
 
+    @memoize_items()
     def tell_units(self, arg, prefix=None):
         arg = arg.strip()
 
@@ -715,7 +1528,7 @@ class WeatherWorkflow(Workflow):
                  autocomplete='options units SI', valid=True)
         ]
 
-        items = self.partial_match_list(arg, items, key=lambda t: t.title)
+        items = self._fuzzy_match(arg, [(i.title, i) for i in items])
 
         if len(items) == 0:
             items.append(Item('Invalid units'))
@@ -732,18 +1545,60 @@ class WeatherWorkflow(Workflow):
         items = []
         query = query.strip()
 
+        recent = self.config.get('recent_locations', [])
+        names = self._fuzzy_match(query, [(l['name'], l['name'])
+                                          for l in recent])
+        for name in names:
+            items.append(Item(name, subtitle='Previously used location',
+                              arg=u'location|' + name, valid=True))
+
         if len(query) > 0:
+            for city in self.gazetteer.prefix(query):
+                name = gazetteer.display_name(city)
+                if name not in names:
+                    items.append(Item(name, arg=u'location|' + name,
+                                      valid=True))
+
+        if len(query) > 0 and not items:
+            # nothing matched locally, so ask the autocomplete service
+            import wunderground
             results = wunderground.autocomplete(query)
             for result in [r for r in results if r['type'] == 'city']:
                 items.append(Item(result['name'],
                                   arg='location|' + result['name'],
                                   valid=True))
-        else:
-            items.append(Item('Enter a location...'))
+        elif len(query) == 0:
+            items.insert(0, Item('Enter a location...'))
 
         return items
 
+    def _remember_location(self, location):
+        '''Add a location to the front of the recently used locations'''
+        recent = [l for l in self.config.get('recent_locations', [])
+                  if l['name'] != location['name']]
+        recent.insert(0, location)
+        self.config['recent_locations'] = recent[:RECENT_LOCATIONS]
+
+    def _use_location(self, location):
+        self.config['location'] = location
+        self._remember_location(location)
+        self._update_tz_table()
+        self.puts(u'Using location {}'.format(location['name']))
+
     def do_location(self, name):
+        for location in self.config.get('recent_locations', []):
+            if location['name'] == name:
+                # a previously used location doesn't need to be looked up
+                self._use_location(location)
+                return
+
+        location = self._local_location(name)
+        if location is not None:
+            self._use_location(dict(location, name=name))
+            return
+
+        import glocation
+
         location_data = glocation.geocode(name)
 
         short_name = name
@@ -763,41 +1618,57 @@ class WeatherWorkflow(Workflow):
             'timezone': tz['timeZoneId']
         }
 
-        self.config['location'] = location
-        self.puts(u'Using location {}'.format(name))
+        self.geocodes[gazetteer.search_key(name)] = location
+        self._use_location(location)
 
     # weather ----------------------------------------------------------
 
     def tell_weather(self, location, prefix=None):
         '''Tell the current conditions and forecast for a location'''
+        items = list(self._iter_weather(location))
+        # jcalfred writes args into its XML as they are
+        for item in items:
+            if getattr(item, 'arg', None):
+                item.arg = clean_str(item.arg)
+        return items
 
+    def _iter_weather(self, location):
+        '''Generate the items for tell_weather as they're ready'''
         location = location.strip()
+        if location == 'compare' or location.startswith('compare '):
+            for item in self._iter_compare(location[len('compare'):]):
+                yield item
+            return
+
         weather = self._get_weather(location)
 
-        items = self._show_alert_information(weather)
+        for item in self._show_alert_information(weather):
+            yield item
+        for item in self._show_rule_matches():
+            yield item
 
         # conditions
         tu = 'F' if self.config['units'] == 'us' else 'C'
+        feelslike = self.config['feelslike']
+        current = weather['current']
         title = u'Currently in {0}: {1}'.format(
-            self.config['location']['short_name'],
-            weather['current']['weather'].capitalize())
+            self.location['short_name'], current['weather'].capitalize())
+        temp = current['feelslike'] if feelslike else current['temp']
         subtitle = u'{0}°{1},  {2}% humidity'.format(
-            int(round(weather['current']['temp'])), tu,
-            int(round(weather['current']['humidity'])))
+            int(round(temp)), tu, int(round(current['humidity'])))
+        if feelslike:
+            subtitle = u'Feels like ' + subtitle
         if self.config['show_localtime']:
             subtitle += ', local time is {0}'.format(
                 self._remotize_time().strftime(self.config['time_format']))
-            if self.config['feelslike']:
-                subtitle = u'Feels like ' + subtitle
 
         icon = self._get_icon(weather['current']['icon'])
-        arg = SERVICES[self.config['service']]['lib'].get_forecast_url(
+        arg = self._service_lib().get_forecast_url(
             location)
-        items.append(
-            Item(title, subtitle, icon=icon, valid=True, arg=clean_str(arg)))
+        yield Item(title, subtitle, icon=icon, valid=True, arg=arg)
 
-        location = '{},{}'.format(self.config['location']['latitude'],
-                                  self.config['location']['longitude'])
+        location = '{},{}'.format(self.location['latitude'],
+                                  self.location['longitude'])
 
         # forecast
         days = self._get_days(weather)
@@ -808,21 +1679,91 @@ class WeatherWorkflow(Workflow):
         for day in days:
             day_desc = self._get_day_desc(day['date'], today_word)
             title = u'{}: {}'.format(day_desc, day['conditions'].capitalize())
-            subtitle = u'High: {}°{},  Low: {}°{}'.format(
-                day['temp_hi'], tu, day['temp_lo'], tu)
+            hi, lo = day['temp_hi'], day['temp_lo']
+            if feelslike and day['feelslike_hi'] is not None:
+                hi, lo = day['feelslike_hi'], day['feelslike_lo']
+            subtitle = u'High: {}°{},  Low: {}°{}'.format(hi, tu, lo, tu)
             if 'precip' in day:
                 subtitle += u',  Precip: {}%'.format(day['precip'])
-            arg = SERVICES[self.config['service']]['lib'].get_forecast_url(
+            arg = self._service_lib().get_forecast_url(
                 location, day['date'])
             icon = self._get_icon(day['icon'])
-            items.append(Item(title, subtitle, icon=icon, arg=clean_str(arg),
-                              valid=True))
+            yield Item(title, subtitle, icon=icon, arg=arg,
+                       valid=True)
 
-        items.append(self._get_copyright_info(weather))
-        return items
+        yield self._get_copyright_info(weather)
+
+    # compare ----------------------------------------------------------
+
+    def _iter_compare(self, query):
+        '''
+        Generate items comparing the forecasts for several locations,
+        separated by semicolons. A single location is compared with the
+        default location.
+        '''
+        queries = [q.strip() for q in query.split(';') if q.strip()]
+        if len(queries) == 0:
+            yield Item('Enter locations to compare...',
+                       subtitle='Separate locations with ";"')
+            return
+        if len(queries) == 1:
+            queries.insert(0, '')
+
+        self._validate_settings()
+        if '' in queries:
+            self._prefetch([self.config['location']])
+        named = [q for q in queries if q]
+        resolved = dict(zip(named, self._resolve_locations(named)))
+
+        locations = []
+        forecasts = []
+        for q in queries:
+            self._location = resolved.get(q)
+            forecasts.append(self._get_location_weather())
+            locations.append(self.location)
+        self._location = None
+
+        # places that share a short name are told apart by their full names
+        short_names = [l['short_name'] for l in locations]
+        names = [l['short_name'] if short_names.count(l['short_name']) == 1
+                 else l['name'] for l in locations]
+
+        result = compare.compare(names, forecasts, self.config['days'],
+                                 self.config['units'])
+        tu = 'F' if self.config['units'] == 'us' else 'C'
+
+        for day in result['days']:
+            day_desc = self._get_day_desc(day['date'])
+            if day['warmest']:
+                title = u'{}: warmest in {} ({}°{})'.format(
+                    day_desc, day['warmest'][0], int(round(day['warmest'][1])),
+                    tu)
+            else:
+                title = day_desc
+
+            parts = []
+            if day['driest']:
+                parts.append(u'Driest: {} ({}% humidity)'.format(
+                    day['driest'][0], int(round(day['driest'][1]))))
+            if day['least_precip']:
+                parts.append(u'Least precip: {} ({}%)'.format(
+                    day['least_precip'][0],
+                    int(round(day['least_precip'][1]))))
+            if day['best_outdoors']:
+                parts.append(u'Best outdoors: {}'.format(
+                    day['best_outdoors'][0]))
+            yield Item(title, u',  '.join(parts))
+
+        for rank, (name, score, best_date) in enumerate(result['ranking'], 1):
+            yield Item(u'{}. {}'.format(rank, name),
+                       u'Outdoor score {:.0f},  best day is {}'.format(
+                           score, self._get_day_desc(best_date)))
+
+        yield self._get_copyright_info(forecasts[0])
 
     # feelslike --------------------------------------------------------
 
+    @memoize_items(settings=('feelslike',))
     def tell_feelslike(self, query, prefix=None):
         feelslike = self.config.get('feelslike', False)
         return [Item('Toggle whether to show "feels like" temperatures',
@@ -837,10 +1778,148 @@ class WeatherWorkflow(Workflow):
         else:
             self.puts('Showing actual temperatures')
 
+    # rules ------------------------------------------------------------
+
+    def tell_rules(self, query, prefix=None):
+        query = query.strip()
+        try:
+            rule = rules.parse(query)
+            items = [Item(u'Add rule "{}"'.format(rule.text),
+                          arg=u'rules|add ' + rule.text, valid=True)]
+        except rules.RuleError:
+            items = [Item('Enter a rule...', subtitle='Like "precip > 60% '
+                          'tomorrow" or "low below 0C in next 3 days at '
+                          'Boston"')]
+
+        existing = self.config.get('rules', [])
+        for text in self._fuzzy_match(query, [(t, t) for t in existing]):
+            items.append(Item(text, subtitle='Select to remove this rule',
+                              arg=u'rules|remove ' + text, valid=True))
+        return items
+
+    def do_rules(self, arg):
+        action, _, text = arg.partition(' ')
+        existing = self.config.get('rules', [])
+        if action == 'add':
+            if text not in existing:
+                self.config['rules'] = existing + [text]
+            self.puts(u'Added rule "{}"'.format(text))
+        elif action == 'remove':
+            self.config['rules'] = [t for t in existing if t != text]
+            self.puts(u'Removed rule "{}"'.format(text))
+        else:
+            LOG.error('Invalid rules action "%s"', action)
+
+    # cache ------------------------------------------------------------
+
+    def tell_cache(self, query, prefix=None):
+        action, _, path = query.strip().partition(' ')
+        path = path.strip() or DEFAULT_SNAPSHOT
+        actions = (
+            ('export', 'Export the cache', u'Write a snapshot to '),
+            ('import', 'Import a cache', u'Merge a snapshot from '),
+        )
+        return [Item(title, subtitle=subtitle + path,
+                     arg=u'cache|{} {}'.format(name, path),
+                     autocomplete=name + ' ', valid=True)
+                for name, title, subtitle in actions
+                if name.startswith(action)]
+
+    def do_cache(self, arg):
+        action, _, path = arg.partition(' ')
+        path = os.path.expanduser(path.strip() or DEFAULT_SNAPSHOT)
+        if action == 'export':
+            count = self.export_cache(path)
+            self.puts(u'Exported {} forecasts to {}'.format(count, path))
+        elif action == 'import':
+            count = self.import_cache(path)
+            self.puts(u'Imported {} forecasts from {}'.format(count, path))
+        else:
+            LOG.error('Invalid cache action "%s"', action)
+
+    def export_cache(self, path):
+        '''
+        Write the cached forecasts, their check times and the geocoded
+        locations (with their timezones) to a snapshot. Returns the number of
+        forecasts written.
+        '''
+        with singleflight.flight(self.lock_dir, self.cache_file):
+            self._cache = None
+            self.checks.reload()
+            forecasts = dict((svc, self.cache[svc]['forecasts'])
+                             for svc in SERVICES if svc in self.cache)
+            snapshot.write(path, {
+                'forecasts': forecasts,
+                'checks': self.checks.data,
+                'geocodes': self.geocodes.data
+            })
+        return sum(len(f) for f in forecasts.values())
+
+    def import_cache(self, path):
+        '''
+        Merge a snapshot into the caches. Each forecast is taken from the
+        snapshot only if it's newer than the cached one for the same place,
+        and forecasts too old to be used are skipped. Returns the number of
+        forecasts taken.
+        '''
+        header, payload = snapshot.read(path)
+        incoming_checks = payload.get('checks', {})
+        now = datetime.now()
+        count = 0
+
+        with singleflight.flight(self.lock_dir, self.cache_file):
+            self._cache = None
+            self.checks.reload()
+
+            for svc, forecasts in payload.get('forecasts', {}).items():
+                if svc not in SERVICES:
+                    continue
+                if svc in self.cache:
+                    service_cache = self.cache[svc]
+                else:
+                    service_cache = {'forecasts': {}}
+                index = self._spatial_index(service_cache)
+                cached = service_cache['forecasts']
+                taken = 0
+
+                for key, entry in forecasts.items():
+                    check_key = '{}:{}'.format(svc, key)
+                    when = self._cache_time(entry)
+                    if check_key in incoming_checks:
+                        when = max(when, datetime.strptime(
+                            incoming_checks[check_key], TIMESTAMP_FMT))
+                    if (now - when).total_seconds() > CACHE_MAX_AGE:
+                        continue
+                    if (key in cached and
+                            self._entry_time(svc, key, cached[key]) >= when):
+                        continue
+
+                    cached[key] = entry
+                    index.add(key)
+                    if check_key in incoming_checks:
+                        self.checks[check_key] = incoming_checks[check_key]
+                    elif check_key in self.checks:
+                        del self.checks[check_key]
+                    taken += 1
+
+                if taken:
+                    # one write per service
+                    self.cache[svc] = service_cache
+                    count += taken
+
+            self.checks.flush()
+
+        for key, location in payload.get('geocodes', {}).items():
+            if key not in self.geocodes:
+                self.geocodes[key] = location
+        self.geocodes.flush()
+
+        return count
+
     # about ------------------------------------------------------------
 
+    @memoize_items(files=('update.json',))
     def tell_about(self, name, query='', prefix=None):
-        import sys
         import json
 
         with open('update.json', 'rt') as uf:
@@ -868,7 +1947,29 @@ class WeatherWorkflow(Workflow):
         )
 
 
+def needs_settings(name, query=''):
+    '''True if a tell or do command needs the settings loaded first'''
+    if name == 'command':
+        # do('command', 'name|arg')
+        name = query.partition('|')[0]
+    elif name == 'commands':
+        # tell('commands', 'options units US') runs tell_units
+        for word in query.split():
+            if not hasattr(WeatherWorkflow, 'tell_' + word):
+                break
+            name = word
+    return name not in NO_SETTINGS_COMMANDS
+
+
+def dispatch(method, name, query='', workflow_class=WeatherWorkflow):
+    '''
+    Call a workflow method like tell('weather', query) on a workflow that
+    only loads its settings if the command needs them.
+    '''
+    workflow = workflow_class(needs_settings(name, query))
+    getattr(workflow, method)(name, query)
+
+
 if __name__ == '__main__':
     from sys import argv
-    ap = WeatherWorkflow()
-    getattr(ap, argv[1])(*argv[2:])
+    dispatch(*argv[1:])
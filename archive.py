@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+'''
+An append-only archive of normalized weather observations and forecasts.
+
+Each location gets a directory of per-day chunk files named for the day the
+data was fetched. A chunk is a flat array of fixed-size binary records, so
+appending is a single write and reading is a memory map. Temperatures are
+stored in degrees Celsius regardless of the units they were fetched in.
+'''
+
+import array
+import mmap
+import os
+import os.path
+import struct
+import time
+from datetime import date, datetime, timedelta
+
+# fetched (epoch), kind, target date (ordinal), lead days, temp, temp_hi,
+# temp_lo, precip (%), humidity (%)
+RECORD = struct.Struct('<dBihfffff')
+COLUMNS = ('fetched', 'kind', 'date', 'lead', 'temp', 'temp_hi', 'temp_lo',
+           'precip', 'humidity')
+TYPECODES = ('d', 'B', 'i', 'h', 'f', 'f', 'f', 'f', 'f')
+
+OBSERVATION = 0
+FORECAST = 1
+
+NAN = float('nan')
+CHUNK_FMT = '%Y%m%d'
+
+
+def _is_nan(value):
+    return value != value
+
+
+def _to_celsius(temp, units):
+    if temp is None:
+        return NAN
+    temp = float(temp)
+    if units == 'us':
+        return (temp - 32) * 5 / 9.0
+    return temp
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def location_dir(archive_dir, latitude, longitude):
+    '''Return the archive directory for a location'''
+    name = '{:.3f}_{:.3f}'.format(float(latitude), float(longitude))
+    return os.path.join(archive_dir, name)
+
+
+def record(archive_dir, latitude, longitude, weather, units):
+    '''
+    Append the current conditions and daily forecast from a normalized
+    weather dict (as produced by WeatherWorkflow._get_weather).
+    '''
+    fetched_at = weather['info']['time']
+    fetched = time.mktime(fetched_at.timetuple())
+    days = weather['forecast']
+    today = days[0]['date'] if days else fetched_at.date()
+
+    current = weather['current']
+    records = [RECORD.pack(
+        fetched, OBSERVATION, today.toordinal(), 0,
+        _to_celsius(current.get('temp'), units), NAN, NAN, NAN,
+        _number(current.get('humidity')))]
+
+    for day in days:
+        records.append(RECORD.pack(
+            fetched, FORECAST, day['date'].toordinal(),
+            (day['date'] - today).days, NAN,
+            _to_celsius(day.get('temp_hi'), units),
+            _to_celsius(day.get('temp_lo'), units),
+            _number(day.get('precip')), _number(day.get('humidity'))))
+
+    loc_dir = location_dir(archive_dir, latitude, longitude)
+    if not os.path.isdir(loc_dir):
+        os.makedirs(loc_dir)
+    chunk = os.path.join(loc_dir, fetched_at.strftime(CHUNK_FMT) + '.dat')
+    with open(chunk, 'ab') as cfile:
+        cfile.write(b''.join(records))
+
+
+def read(archive_dir, latitude, longitude, start=None, end=None):
+    '''
+    Read the records fetched between two dates (inclusive) as columns.
+
+    The result is a dict mapping each name in COLUMNS to an array.
+    '''
+    columns = dict((name, array.array(code))
+                   for name, code in zip(COLUMNS, TYPECODES))
+    loc_dir = location_dir(archive_dir, latitude, longitude)
+    if not os.path.isdir(loc_dir):
+        return columns
+
+    first = start.strftime(CHUNK_FMT) if start else None
+    last = end.strftime(CHUNK_FMT) if end else None
+    appenders = [columns[name].append for name in COLUMNS]
+
+    for filename in sorted(os.listdir(loc_dir)):
+        day, ext = os.path.splitext(filename)
+        if ext != '.dat':
+            continue
+        if (first and day < first) or (last and day > last):
+            continue
+
+        path = os.path.join(loc_dir, filename)
+        size = os.path.getsize(path)
+        # ignore any partial record left by an interrupted write
+        size -= size % RECORD.size
+        if size == 0:
+            continue
+
+        with open(path, 'rb') as cfile:
+            data = mmap.mmap(cfile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, RECORD.size):
+                    values = RECORD.unpack_from(data, offset)
+                    for append, value in zip(appenders, values):
+                        append(value)
+            finally:
+                data.close()
+
+    return columns
+
+
+def temperatures(archive_dir, latitude, longitude, days=30):
+    '''
+    Return (time, temperature) pairs observed at a location over the last
+    few days, oldest first.
+    '''
+    start = date.today() - timedelta(days=days)
+    columns = read(archive_dir, latitude, longitude, start)
+    return [(datetime.fromtimestamp(fetched), temp)
+            for fetched, kind, temp in zip(columns['fetched'],
+                                           columns['kind'], columns['temp'])
+            if kind == OBSERVATION and not _is_nan(temp)]
+
+
+def forecast_accuracy(archive_dir, latitude, longitude, lead=3, days=30):
+    '''
+    Compare forecasts made some number of days ahead with what was
+    eventually reported for the same day.
+
+    The last same-day forecast for a date stands in for its actual high, low
+    and chance of precipitation. Returns the number of days compared and the
+    mean absolute error of each value (None if nothing could be compared).
+    '''
+    start = date.today() - timedelta(days=days + lead)
+    columns = read(archive_dir, latitude, longitude, start)
+    rows = zip(columns['fetched'], columns['kind'], columns['date'],
+               columns['lead'], columns['temp_hi'], columns['temp_lo'],
+               columns['precip'])
+
+    actual = {}
+    predicted = {}
+    for fetched, kind, day, day_lead, hi, lo, precip in rows:
+        if kind != FORECAST:
+            continue
+        if day_lead == 0:
+            actual[day] = (hi, lo, precip)
+        elif day_lead == lead and day not in predicted:
+            # use the earliest forecast made with this lead time
+            predicted[day] = (hi, lo, precip)
+
+    errors = ([], [], [])
+    for day, values in predicted.items():
+        if day not in actual:
+            continue
+        for errs, guess, real in zip(errors, values, actual[day]):
+            if not _is_nan(guess) and not _is_nan(real):
+                errs.append(abs(guess - real))
+
+    def mean(values):
+        return sum(values) / len(values) if values else None
+
+    return {
+        'days': len([d for d in predicted if d in actual]),
+        'temp_hi': mean(errors[0]),
+        'temp_lo': mean(errors[1]),
+        'precip': mean(errors[2])
+    }
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    from pprint import pformat
+
+    parser = ArgumentParser()
+    parser.add_argument('archive', help='Archive directory')
+    parser.add_argument('query', choices=('temps', 'accuracy'))
+    parser.add_argument('latitude', type=float)
+    parser.add_argument('longitude', type=float)
+    parser.add_argument('-d', '--days', type=int, default=30)
+    parser.add_argument('-l', '--lead', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.query == 'temps':
+        for when, temp in temperatures(args.archive, args.latitude,
+                                       args.longitude, args.days):
+            print '{}  {:.1f}'.format(when, temp)
+    else:
+        print pformat(forecast_accuracy(args.archive, args.latitude,
+                                        args.longitude, args.lead, args.days))
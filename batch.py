@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+'''
+Get forecasts for many locations without Alfred.
+
+Location queries are read one per line from a file or stdin, and one JSON
+object is written to stdout for each, as soon as it's ready:
+
+    {"query": "...", "location": {...}, "weather": {...}}
+
+or, if a query couldn't be answered:
+
+    {"query": "...", "error": "..."}
+
+Queries are resolved and their forecasts fetched a few at a time, using the
+workflow's configured service, units and shared caches, so repeated or
+nearby locations don't cause more requests.
+'''
+
+import json
+import logging
+import sys
+from argparse import ArgumentParser, FileType
+from datetime import date, datetime
+
+from alfred_weather import WeatherWorkflow
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 8
+
+
+def _encode(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def read_queries(lines):
+    '''Return the queries in some lines, skipping blanks and # comments'''
+    for line in lines:
+        line = line.decode('utf-8').strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _resolve(workflow, queries):
+    '''
+    Return (query, location, error) for each query, looking the queries up
+    together when possible
+    '''
+    try:
+        locations = workflow._resolve_locations(queries)
+        return [(q, l, None) for q, l in zip(queries, locations)]
+    except Exception:
+        if len(queries) == 1:
+            raise
+    # something in the chunk failed, so find out which
+    results = []
+    for query in queries:
+        try:
+            results.append((query, workflow._resolve_locations([query])[0],
+                            None))
+        except Exception as e:
+            LOG.exception('Error resolving %s', query)
+            results.append((query, None, e))
+    return results
+
+
+def forecasts(workflow, queries, jobs=DEFAULT_JOBS):
+    '''Generate a result dict for each of some location queries'''
+    for chunk in _chunks(queries, jobs):
+        try:
+            resolved = _resolve(workflow, chunk)
+        except Exception as e:
+            LOG.exception('Error resolving %s', chunk[0])
+            resolved = [(chunk[0], None, e)]
+
+        for query, location, error in resolved:
+            if error:
+                yield {'query': query, 'error': unicode(error)}
+                continue
+            try:
+                workflow._location = location
+                weather = workflow._get_location_weather()
+                yield {'query': query, 'location': location,
+                       'weather': weather}
+            except Exception as e:
+                LOG.exception('Error getting weather for %s', query)
+                yield {'query': query, 'error': unicode(e)}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Write a JSON forecast line for each '
+                            'location query read from a file or stdin')
+    parser.add_argument('input', nargs='?', type=FileType('r'),
+                        default=sys.stdin, help='File of location queries, '
+                        'one per line (default: stdin)')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help='Number of queries to look up at once')
+    args = parser.parse_args()
+
+    workflow = WeatherWorkflow()
+    service = workflow.config.get('service')
+    if not service or 'key.' + service not in workflow.config:
+        parser.error('A weather service and API key must be configured; '
+                     'use the "wset service" command')
+
+    for result in forecasts(workflow, read_queries(args.input),
+                            max(args.jobs, 1)):
+        print json.dumps(result, default=_encode, ensure_ascii=False,
+                         sort_keys=True).encode('utf-8')
+        sys.stdout.flush()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+'''
+How the weather feels: heat index, wind chill, dew point and apparent
+temperature, computed from temperature, relative humidity and wind speed.
+
+Every function takes either single values or equal-length sequences (single
+values are repeated to match), and returns a value or a list to match, so a
+whole forecast can be handled in one call. Temperatures and wind speeds are
+in the given unit system: 'us' for Fahrenheit and mph, 'si' for Celsius
+and km/h. Humidity is a percentage.
+
+The heat index and wind chill formulas are the US National Weather
+Service's.
+'''
+
+import functools
+import math
+
+MPH_PER_KPH = 0.621371
+
+
+def _is_sequence(value):
+    return isinstance(value, (list, tuple))
+
+
+def elementwise(func):
+    '''
+    Let a function of single values also be called with sequences, in which
+    case it's applied to each set of corresponding values
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        lengths = [len(a) for a in args if _is_sequence(a)]
+        if not lengths:
+            return func(*args, **kwargs)
+        columns = [a if _is_sequence(a) else [a] * lengths[0] for a in args]
+        return [func(*row, **kwargs) for row in zip(*columns)]
+    return wrapper
+
+
+def _to_f(temp, units):
+    return temp if units == 'us' else temp * 9.0 / 5 + 32
+
+
+def _from_f(temp, units):
+    return temp if units == 'us' else (temp - 32) * 5.0 / 9
+
+
+def _to_mph(speed, units):
+    return speed if units == 'us' else speed * MPH_PER_KPH
+
+
+@elementwise
+def dew_point(temp, humidity, units='us'):
+    '''Return the dew point (Magnus formula)'''
+    if temp is None or not humidity:
+        return None
+    temp_c = (_to_f(temp, units) - 32) * 5.0 / 9
+    gamma = math.log(humidity / 100.0) + 17.62 * temp_c / (243.12 + temp_c)
+    dew_c = 243.12 * gamma / (17.62 - gamma)
+    return _from_f(dew_c * 9.0 / 5 + 32, units)
+
+
+@elementwise
+def heat_index(temp, humidity, units='us'):
+    '''Return the heat index, or the temperature where it doesn't apply'''
+    if temp is None or humidity is None:
+        return temp
+    t = _to_f(temp, units)
+    rh = float(humidity)
+
+    index = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    if (index + t) / 2 < 80:
+        return temp
+
+    index = (-42.379 + 2.04901523 * t + 10.14333127 * rh -
+             0.22475541 * t * rh - 0.00683783 * t * t -
+             0.05481717 * rh * rh + 0.00122874 * t * t * rh +
+             0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+    if rh < 13 and 80 <= t <= 112:
+        index -= ((13 - rh) / 4) * math.sqrt((17 - abs(t - 95)) / 17)
+    elif rh > 85 and 80 <= t <= 87:
+        index += ((rh - 85) / 10) * ((87 - t) / 5)
+    return _from_f(index, units)
+
+
+@elementwise
+def wind_chill(temp, wind, units='us'):
+    '''Return the wind chill, or the temperature where it doesn't apply'''
+    if temp is None or wind is None:
+        return temp
+    t = _to_f(temp, units)
+    v = _to_mph(wind, units)
+    if t > 50 or v < 3:
+        return temp
+    v16 = v ** 0.16
+    return _from_f(35.74 + 0.6215 * t - 35.75 * v16 + 0.4275 * t * v16,
+                   units)
+
+
+@elementwise
+def apparent_temperature(temp, humidity, wind, units='us'):
+    '''
+    Return how warm it feels: the wind chill when it's cold and windy, the
+    heat index when it's hot, and otherwise the temperature
+    '''
+    if temp is None:
+        return None
+    if _to_f(temp, units) <= 50:
+        return wind_chill(temp, wind, units)
+    return heat_index(temp, humidity, units)
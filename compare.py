@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+'''
+Compare the daily forecasts of several locations.
+
+Forecasts are the normalized weather dicts produced by
+WeatherWorkflow._get_weather. Each day's values are gathered into columns
+(one row per location) and every statistic is computed over a whole column
+at once.
+'''
+
+# the temperature considered ideal for being outside, and how many points a
+# degree away from it costs
+COMFORT_TEMP = {'us': 70.0, 'si': 21.0}
+COMFORT_SCALE = {'us': 1.0, 'si': 1.8}
+PRECIP_SCALE = 0.5
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_table(names, forecasts, days):
+    '''
+    Arrange the first few days of several forecasts into columns by date.
+
+    Returns a list of (date, columns) tuples, where columns maps 'index'
+    (the location's position in names), 'name', 'temp_hi', 'temp_lo',
+    'precip' and 'humidity' to equal-length lists.
+    '''
+    by_date = {}
+    for index, (name, weather) in enumerate(zip(names, forecasts)):
+        for day in weather['forecast'][:days]:
+            columns = by_date.setdefault(day['date'], {
+                'index': [], 'name': [], 'temp_hi': [], 'temp_lo': [],
+                'precip': [], 'humidity': []
+            })
+            columns['index'].append(index)
+            columns['name'].append(name)
+            for key in ('temp_hi', 'temp_lo', 'precip', 'humidity'):
+                columns[key].append(_number(day.get(key)))
+    return sorted(by_date.items())
+
+
+def outdoor_scores(columns, units):
+    '''
+    Score how pleasant each row of a day's columns is for being outside.
+
+    A score starts at 100 and loses points for the day's average temperature
+    being away from COMFORT_TEMP and for the chance of precipitation.
+    '''
+    ideal = COMFORT_TEMP[units]
+    scale = COMFORT_SCALE[units]
+    scores = []
+    for hi, lo, precip in zip(columns['temp_hi'], columns['temp_lo'],
+                              columns['precip']):
+        if hi is None or lo is None:
+            scores.append(None)
+            continue
+        score = 100 - scale * abs((hi + lo) / 2.0 - ideal)
+        score -= PRECIP_SCALE * (precip or 0)
+        scores.append(score)
+    return scores
+
+
+def _best(names, values, highest=True):
+    '''Return the (name, value) with the highest or lowest value'''
+    pairs = [(v, n) for n, v in zip(names, values) if v is not None]
+    if not pairs:
+        return None
+    value, name = max(pairs) if highest else min(pairs)
+    return name, value
+
+
+def compare(names, forecasts, days, units):
+    '''
+    Compare forecasts for several locations.
+
+    Returns a dict with a 'days' list giving the warmest, driest (lowest
+    humidity), least rainy and best for outdoors location for each date, and
+    a 'ranking' list of (name, average outdoor score, best date) tuples,
+    best first.
+    '''
+    table = build_table(names, forecasts, days)
+    results = []
+    # locations are kept apart by position, since names may repeat
+    totals = [[] for name in names]
+    best_days = {}
+
+    for fdate, columns in table:
+        scores = outdoor_scores(columns, units)
+        results.append({
+            'date': fdate,
+            'warmest': _best(columns['name'], columns['temp_hi']),
+            'driest': _best(columns['name'], columns['humidity'], False),
+            'least_precip': _best(columns['name'], columns['precip'], False),
+            'best_outdoors': _best(columns['name'], scores)
+        })
+
+        for index, score in zip(columns['index'], scores):
+            if score is None:
+                continue
+            totals[index].append(score)
+            if index not in best_days or score > best_days[index][1]:
+                best_days[index] = (fdate, score)
+
+    ranking = []
+    for index, name in enumerate(names):
+        if totals[index]:
+            average = sum(totals[index]) / len(totals[index])
+            ranking.append((name, average, best_days[index][0]))
+    ranking.sort(key=lambda r: r[1], reverse=True)
+
+    return {'days': results, 'ranking': ranking}
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+'''
+Base URLs for the upstream web APIs.
+
+Any API can be redirected with a JC_WEATHER_<NAME>_URL environment variable
+(e.g., JC_WEATHER_FORECASTIO_URL), and all of them can be pointed at a single
+server, such as mock_server.py, with JC_WEATHER_API_BASE. In the latter case
+each API is served under /<name> on that server.
+'''
+
+import os
+
+DEFAULTS = {
+    'forecastio': 'https://api.forecast.io',
+    'wunderground': 'http://api.wunderground.com',
+    'autocomplete': 'http://autocomplete.wunderground.com',
+    'google': 'https://maps.googleapis.com',
+}
+
+_overrides = {}
+
+
+def set_url(name, url):
+    '''Use a different base URL for one API'''
+    _overrides[name] = url.rstrip('/')
+
+
+def set_base(base):
+    '''Serve every API from one server, under /<name>'''
+    for name in DEFAULTS:
+        set_url(name, '{}/{}'.format(base.rstrip('/'), name))
+
+
+def reset():
+    '''Go back to the default (or environment-provided) URLs'''
+    _overrides.clear()
+
+
+def url(name):
+    '''Return the base URL for an API'''
+    if name in _overrides:
+        return _overrides[name]
+
+    env_url = os.environ.get('JC_WEATHER_{}_URL'.format(name.upper()))
+    if env_url:
+        return env_url.rstrip('/')
+
+    base = os.environ.get('JC_WEATHER_API_BASE')
+    if base:
+        return '{}/{}'.format(base.rstrip('/'), name)
+
+    return DEFAULTS[name]
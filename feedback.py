@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+'''
+Write Alfred script filter feedback as items are produced.
+
+Two formats are supported: the JSON format understood by Alfred 3 and later,
+which adds ``rerun``, ``variables`` and result caching hints, and the XML
+format used by Alfred 2. Writers emit each item as soon as it's given to them,
+so a script filter never has to build its whole result list first.
+'''
+
+import json
+import os
+import sys
+from xml.sax.saxutils import escape, quoteattr
+from jcalfred import Item
+
+ITEM_FIELDS = ('uid', 'title', 'subtitle', 'arg', 'autocomplete', 'valid',
+               'icon')
+XML_ATTRS = ('uid', 'arg', 'autocomplete', 'valid')
+XML_ELEMENTS = ('title', 'subtitle', 'icon')
+
+
+def default_format():
+    '''Return the best feedback format for the running version of Alfred'''
+    version = os.environ.get('alfred_version', '')
+    try:
+        if int(version.partition('.')[0]) >= 3:
+            return 'json'
+    except ValueError:
+        pass
+    return 'xml'
+
+
+def item_to_dict(item):
+    '''Return the feedback fields of an Item that have values'''
+    data = {}
+    for name in ITEM_FIELDS:
+        value = getattr(item, name, None)
+        if value is not None:
+            data[name] = value
+    return data
+
+
+def item_from_dict(data):
+    '''Create an Item from a dict returned by item_to_dict'''
+    fields = dict(data)
+    title = fields.pop('title')
+    return Item(title, **fields)
+
+
+def _json_fields(fields):
+    '''Encode fields as the body of a JSON object (without braces)'''
+    data = {}
+    for name, value in fields.items():
+        if name == 'icon':
+            value = {'path': value}
+        elif name == 'valid':
+            value = bool(value)
+        data[name] = value
+    return json.dumps(data, sort_keys=True)[1:-1]
+
+
+def _xml_fields(fields):
+    '''Encode fields as XML attribute and element strings'''
+    attrs = []
+    elements = []
+    for name in XML_ATTRS:
+        if name in fields:
+            value = fields[name]
+            if name == 'valid':
+                value = 'yes' if value else 'no'
+            attrs.append(u' {}={}'.format(name, quoteattr(unicode(value))))
+    for name in XML_ELEMENTS:
+        if name in fields:
+            elements.append(u'<{0}>{1}</{0}>'.format(
+                name, escape(unicode(fields[name]))))
+    return u''.join(attrs), u''.join(elements)
+
+
+class ItemTemplate(object):
+
+    '''
+    A partially pre-encoded item for rows that are mostly fixed.
+
+    The fixed fields are encoded once; items created with item() only need
+    their remaining fields encoded when they're written.
+    '''
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.json = _json_fields(fields)
+        self.xml = _xml_fields(fields)
+
+    def item(self, **fields):
+        '''Return an Item made from this template and some extra fields'''
+        data = dict(self.fields)
+        data.update(fields)
+        item = item_from_dict(data)
+        item.template = self
+        item.template_fields = fields
+        return item
+
+
+class JsonWriter(object):
+
+    '''Write Alfred 3+ JSON feedback'''
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.rerun = None
+        self.variables = {}
+        self.cache = None
+        self._started = False
+
+    def write(self, item):
+        if not self._started:
+            self.stream.write('{"items": [')
+            self._started = True
+        if self.count > 0:
+            self.stream.write(', ')
+        self.stream.write(self._encode(item))
+        self.count += 1
+
+    def close(self):
+        if not self._started:
+            self.stream.write('{"items": [')
+        self.stream.write(']')
+        if self.rerun:
+            self.stream.write(', "rerun": {}'.format(json.dumps(self.rerun)))
+        if self.variables:
+            self.stream.write(', "variables": {}'.format(
+                json.dumps(self.variables)))
+        if self.cache:
+            self.stream.write(', "cache": {}'.format(json.dumps(self.cache)))
+        self.stream.write('}\n')
+        self.stream.flush()
+
+    def _encode(self, item):
+        template = getattr(item, 'template', None)
+        if template is None:
+            return '{' + _json_fields(item_to_dict(item)) + '}'
+        extra = item.template_fields
+        if not extra:
+            return '{' + template.json + '}'
+        return '{' + template.json + ', ' + _json_fields(extra) + '}'
+
+
+class XmlWriter(object):
+
+    '''
+    Write Alfred 2 XML feedback
+
+    XML feedback has no equivalent of rerun, variables or cache; those
+    attributes are accepted and ignored.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.rerun = None
+        self.variables = {}
+        self.cache = None
+        self._started = False
+
+    def write(self, item):
+        if not self._started:
+            self.stream.write('<?xml version="1.0"?><items>')
+            self._started = True
+        self.stream.write(self._encode(item).encode('utf-8'))
+        self.count += 1
+
+    def close(self):
+        if not self._started:
+            self.stream.write('<?xml version="1.0"?><items>')
+        self.stream.write('</items>\n')
+        self.stream.flush()
+
+    def _encode(self, item):
+        template = getattr(item, 'template', None)
+        if template is None:
+            attrs, elements = _xml_fields(item_to_dict(item))
+        else:
+            attrs, elements = _xml_fields(item.template_fields)
+            attrs = template.xml[0] + attrs
+            elements = template.xml[1] + elements
+        return u'<item{}>{}</item>'.format(attrs, elements)
+
+
+def writer(fmt=None, stream=None):
+    '''Return a feedback writer for a format ('json' or 'xml')'''
+    fmt = fmt or default_format()
+    if fmt == 'json':
+        return JsonWriter(stream)
+    return XmlWriter(stream)
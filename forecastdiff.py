@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''
+Tell whether a newly fetched forecast says anything different from the last
+one.
+
+Provider responses include values that change with every request (the
+observation time, the time the response was generated) even when the
+forecast itself hasn't changed. normalize() strips those out, digest()
+gives a hash of what's left, and changes() lists the dotted paths of the
+values that differ between two forecasts.
+'''
+
+import copy
+import hashlib
+import json
+
+# values that change on every request, by service
+VOLATILE = {
+    'fio': ('currently.time', 'flags.sources'),
+    'wund': ('response',
+             'current_observation.observation_time',
+             'current_observation.observation_time_rfc822',
+             'current_observation.observation_epoch',
+             'current_observation.local_time_rfc822',
+             'current_observation.local_epoch'),
+}
+
+
+def normalize(service, data):
+    '''Return a copy of a forecast without its volatile values'''
+    data = copy.deepcopy(data)
+    for path in VOLATILE.get(service, ()):
+        parts = path.split('.')
+        node = data
+        for part in parts[:-1]:
+            node = node.get(part) if isinstance(node, dict) else None
+        if isinstance(node, dict):
+            node.pop(parts[-1], None)
+    return data
+
+
+def digest(normalized):
+    '''Return a hash of a normalized forecast'''
+    text = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def changes(old, new, prefix=''):
+    '''
+    Return the sorted dotted paths (list items are numbered) of the values
+    that differ between two normalized forecasts
+    '''
+    if isinstance(old, dict) and isinstance(new, dict):
+        paths = []
+        for key in set(old) | set(new):
+            path = prefix + unicode(key)
+            if key not in old or key not in new:
+                paths.append(path)
+            else:
+                paths.extend(changes(old[key], new[key], path + '.'))
+        return sorted(paths)
+
+    if (isinstance(old, list) and isinstance(new, list) and
+            len(old) == len(new)):
+        paths = []
+        for i, (old_item, new_item) in enumerate(zip(old, new)):
+            paths.extend(changes(old_item, new_item,
+                                 '{}{}.'.format(prefix, i)))
+        return paths
+
+    if old != new:
+        return [prefix.rstrip('.')]
+    return []
@@ -5,12 +5,17 @@ Get weather data from Forecast.io
 '''
 
 import datetime
-import requests
+import endpoints
 import time
+import transport
 
 URL_TEMPLATE = 'http://forecast.io/#/f'
-API_TEMPLATE = 'https://api.forecast.io/forecast/{}'
-api = None
+API_TEMPLATE = '{}/forecast/{}'
+# the parts of a forecast the workflow uses
+FIELDS = ('currently', 'daily.data', 'alerts', 'flags', 'error')
+# blocks the API doesn't need to send at all
+EXCLUDE = 'minutely,hourly'
+key = None
 
 
 class WeatherException(Exception):
@@ -20,8 +25,12 @@ class WeatherException(Exception):
 
 
 def set_key(api_key):
-    global api
-    api = API_TEMPLATE.format(api_key)
+    global key
+    key = api_key
+
+
+def get_api():
+    return API_TEMPLATE.format(endpoints.url('forecastio'), key)
 
 
 def get_forecast_url(location, date=None):
@@ -34,15 +43,40 @@ def get_forecast_url(location, date=None):
     return url
 
 
-def forecast(location, params=None):
+def forecast(location, params=None, fields=FIELDS):
     '''
     Get a forecast for a location
 
-    The location must be lat,lng (e.g., -38.5,85.234)
+    The location must be lat,lng (e.g., -38.5,85.234). Only the given dotted
+    paths are decoded from the response (and the minutely and hourly blocks
+    aren't requested); use fields=None to get the complete forecast.
+    '''
+    return fetch(location, params, fields).data
+
+
+def fetch(location, params=None, fields=FIELDS, validators=None):
     '''
-    url = '{}/{}'.format(api, location)
+    Get a forecast like forecast(), but only if it has changed since the
+    response some validators came from. Returns a transport.Fetched whose
+    data is None if it hasn't.
+    '''
+    url = '{}/{}'.format(get_api(), location)
     headers = {'Accept-Encoding': 'gzip'}
-    r = requests.get(url, params=params, headers=headers)
+    if fields:
+        params = dict(params or {})
+        params.setdefault('exclude', EXCLUDE)
+    headers.update(transport.conditional_headers(url, params, validators))
+    r = transport.get(url, params=params, headers=headers,
+                      stream=fields is not None)
+    try:
+        return _read_forecast(r, fields, validators)
+    finally:
+        r.close()
+
+
+def _read_forecast(r, fields, validators):
+    if r.status_code == 304:
+        return transport.Fetched(None, transport.validators(r, validators))
 
     if r.status_code != 200:
         msg = 'forecast.io seems to be down'
@@ -57,12 +91,23 @@ def forecast(location, params=None):
                 msg = 'forecast.io returned code {}'.format(r.status_code)
         raise WeatherException(msg)
 
-    r = r.json()
-    if 'error' in r:
-        raise WeatherException('Error getting weather: {}'.format(r['error']),
-                               r['error'])
+    data = transport.read_json(r, fields)
+    if 'error' in data:
+        raise WeatherException('Error getting weather: {}'.format(
+            data['error']), data['error'])
+
+    return transport.Fetched(data, transport.validators(r))
+
+
+def forecast_async(location, params=None, deadline=None):
+    '''Start getting a forecast; returns a transport.Future'''
+    return transport.submit(forecast, location, params, deadline=deadline)
+
 
-    return r
+def fetch_async(location, params=None, validators=None, deadline=None):
+    '''Start a conditional forecast request; returns a transport.Future'''
+    return transport.submit(fetch, location, params, validators=validators,
+                            deadline=deadline)
 
 
 if __name__ == '__main__':
@@ -76,4 +121,5 @@ if __name__ == '__main__':
     set_key(args.key)
 
     from pprint import pformat
-    print pformat(forecast('{},{}'.format(args.latitude, args.longitude)))
+    print pformat(forecast('{},{}'.format(args.latitude, args.longitude),
+                           fields=None))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+'''
+A small trigram index for fuzzy matching short strings, like menu entries,
+icon set names and location names.
+
+Each indexed string is split into words, and each word into trigrams (runs
+of three characters, padded so the start of a word is its own trigram). A
+query is looked up by its trigrams, so only entries sharing at least one of
+them are ever scored, however many entries there are.
+'''
+
+import re
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# the fraction of a query's trigrams an entry has to contain to match
+MIN_SCORE = 0.5
+
+
+def _words(text):
+    return WORD.findall(text.lower())
+
+
+def trigrams(text):
+    '''Return the set of trigrams in a string'''
+    grams = set()
+    for word in _words(text):
+        padded = '  ' + word + ' '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class FuzzyIndex(object):
+
+    '''An index of (text, value) entries that can be searched by text'''
+
+    def __init__(self, entries=()):
+        self._entries = []
+        self._grams = {}
+        for text, value in entries:
+            self.add(text, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, text, value):
+        '''Index a value under some text'''
+        entry_id = len(self._entries)
+        self._entries.append((text.lower(), value))
+        for gram in trigrams(text):
+            self._grams.setdefault(gram, set()).add(entry_id)
+
+    def score(self, query, entry_id):
+        text = self._entries[entry_id][0]
+        query_grams = trigrams(query)
+        score = (len(query_grams & trigrams(text)) /
+                 float(len(query_grams) or 1))
+        if text == query:
+            score += 2
+        elif text.startswith(query):
+            score += 1
+        elif any(w.startswith(query) for w in _words(text)):
+            score += 0.5
+        return score
+
+    def search(self, query, limit=None):
+        '''
+        Return the values matching a query, best match first. An empty query
+        matches every entry, in the order they were added.
+        '''
+        query = query.strip().lower()
+        if not query:
+            values = [value for text, value in self._entries]
+            return values[:limit] if limit else values
+
+        candidates = set()
+        for gram in trigrams(query):
+            candidates.update(self._grams.get(gram, ()))
+
+        scored = []
+        for entry_id in candidates:
+            score = self.score(query, entry_id)
+            if score >= MIN_SCORE:
+                scored.append((-score, entry_id))
+        scored.sort()
+        if limit:
+            scored = scored[:limit]
+        return [self._entries[entry_id][1] for score, entry_id in scored]
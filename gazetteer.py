@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+'''
+A bundled gazetteer of cities, so common places can be found without asking
+a web service.
+
+The gazetteer is a tab-separated text file with one city per line, sorted by
+a search key (the city's name folded to lowercase ASCII):
+
+    key  name  admin code  admin name  country code  country name
+    latitude  longitude  timezone  population
+
+The file is memory-mapped and searched by bisecting on line boundaries, so a
+lookup only reads the few lines near the query and the file never has to be
+loaded or parsed as a whole.
+
+Run this module with a GeoNames cities file (like cities15000.txt from
+http://download.geonames.org/export/dump/) to build a gazetteer from it.
+'''
+
+import mmap
+import os.path
+import re
+import unicodedata
+from collections import namedtuple
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'cities.tsv')
+
+City = namedtuple('City', ('name', 'admin_code', 'admin_name', 'country',
+                           'country_name', 'latitude', 'longitude',
+                           'timezone', 'population'))
+
+
+def search_key(text):
+    '''Fold text to the lowercase ASCII form used for searching'''
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ascii', 'ignore').lower()
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+
+def display_name(city):
+    '''Return a name for a city like "Boston, Massachusetts, United States"'''
+    parts = [city.name]
+    if city.admin_name and search_key(city.admin_name) != search_key(
+            city.name):
+        parts.append(city.admin_name)
+    parts.append(city.country_name or city.country)
+    return u', '.join(parts)
+
+
+def _parse(line):
+    fields = line.rstrip('\n').decode('utf-8').split('\t')
+    return City(fields[1], fields[2], fields[3], fields[4], fields[5],
+                float(fields[6]), float(fields[7]), fields[8], int(fields[9]))
+
+
+class Gazetteer(object):
+
+    '''A sorted gazetteer file, opened on first use'''
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            with open(self.path, 'rb') as gfile:
+                self._data = mmap.mmap(gfile.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        return self._data
+
+    def _line_start(self, pos):
+        '''Return the offset of the start of the line containing pos'''
+        return self.data.rfind('\n', 0, pos) + 1
+
+    def _first(self, key):
+        '''
+        Return the offset of the first line whose key (with its trailing tab)
+        is >= key
+        '''
+        data = self.data
+        lo, hi = 0, len(data)
+        while lo < hi:
+            mid = self._line_start((lo + hi) // 2)
+            end = data.find('\n', mid)
+            end = len(data) if end == -1 else end + 1
+            if data[mid:data.find('\t', mid) + 1] < key:
+                lo = end
+            else:
+                hi = mid
+        return lo
+
+    def _lines(self, key):
+        '''Generate the lines whose keys start with key'''
+        data = self.data
+        pos = self._first(key)
+        while pos < len(data):
+            end = data.find('\n', pos)
+            end = len(data) if end == -1 else end + 1
+            line = data[pos:end]
+            if not line.startswith(key):
+                return
+            yield line
+            pos = end
+
+    def prefix(self, query, limit=10):
+        '''Return the most populous cities whose names start with a query'''
+        key = search_key(query)
+        if not key:
+            return []
+        cities = [_parse(line) for line in self._lines(key)]
+        cities.sort(key=lambda c: -c.population)
+        return cities[:limit]
+
+    def lookup(self, query):
+        '''
+        Return the city best matching a query like "Paris", "Portland, ME" or
+        "Paris, France", or None if the gazetteer doesn't have it.
+        '''
+        parts = [search_key(p) for p in query.split(',')]
+        if not parts[0]:
+            return None
+        qualifiers = [p for p in parts[1:] if p]
+
+        best = None
+        for line in self._lines(parts[0] + '\t'):
+            city = _parse(line)
+            names = set(search_key(n) for n in (city.admin_code,
+                                                city.admin_name,
+                                                city.country,
+                                                city.country_name))
+            if any(q not in names for q in qualifiers):
+                continue
+            if best is None or city.population > best.population:
+                best = city
+        return best
+
+
+def write(cities, path):
+    '''Write a gazetteer file from an iterable of Cities'''
+    lines = []
+    for city in cities:
+        fields = [search_key(city.name), city.name, city.admin_code,
+                  city.admin_name, city.country, city.country_name,
+                  '{:.4f}'.format(city.latitude),
+                  '{:.4f}'.format(city.longitude), city.timezone,
+                  str(city.population)]
+        lines.append(u'\t'.join(fields).encode('utf-8') + '\n')
+    lines.sort()
+    with open(path, 'wb') as gfile:
+        gfile.writelines(lines)
+
+
+def _read_names(path, code_column, name_column):
+    names = {}
+    if path:
+        with open(path, 'rb') as nfile:
+            for line in nfile:
+                if line.startswith('#'):
+                    continue
+                fields = line.decode('utf-8').split('\t')
+                names[fields[code_column]] = fields[name_column]
+    return names
+
+
+def read_geonames(path, admin_path=None, country_path=None,
+                  min_population=0):
+    '''
+    Generate Cities from a GeoNames cities file and, optionally, its
+    admin1CodesASCII.txt file of region names and countryInfo.txt file of
+    country names
+    '''
+    admin_names = _read_names(admin_path, 0, 1)
+    country_names = _read_names(country_path, 0, 4)
+
+    with open(path, 'rb') as cfile:
+        for line in cfile:
+            fields = line.decode('utf-8').split('\t')
+            population = int(fields[14] or 0)
+            if population < min_population:
+                continue
+            country, admin_code = fields[8], fields[10]
+            yield City(fields[1], admin_code, admin_names.get(
+                '{}.{}'.format(country, admin_code), u''), country,
+                country_names.get(country, u''), float(fields[4]),
+                float(fields[5]), fields[17], population)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Build a gazetteer from GeoNames '
+                            'data')
+    parser.add_argument('cities', help='GeoNames cities file')
+    parser.add_argument('-a', '--admin', help='GeoNames admin1 codes file')
+    parser.add_argument('-c', '--countries', help='GeoNames country file')
+    parser.add_argument('-m', '--min-population', type=int, default=0)
+    parser.add_argument('-o', '--output', default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    write(read_geonames(args.cities, args.admin, args.countries,
+                        args.min_population), args.output)
@@ -4,14 +4,19 @@
 Use the Google location APIs to lookup information about physical locations.
 '''
 
-import requests
+import endpoints
 import time
+import transport
+
+GEOCODE_TEMPLATE = '{}/maps/api/geocode/json'
+TIMEZONE_TEMPLATE = '{}/maps/api/timezone/json'
+
 
 def geocode(location):
     '''Get the physical coordiantes of a place (ZIP, city, address, etc).'''
-    api = 'http://maps.googleapis.com/maps/api/geocode/json'
+    api = GEOCODE_TEMPLATE.format(endpoints.url('google'))
     params = {'address': location, 'sensor': 'false'}
-    r = requests.get(api, params=params).json()
+    r = transport.get(api, params=params).json()
 
     if r.get('status') == 'OK':
         results = r['results'][0]
@@ -27,13 +32,13 @@ def geocode(location):
 
 def timezone(lat, lng):
     '''Get the timezone of a physical location.'''
-    api = 'https://maps.googleapis.com/maps/api/timezone/json'
+    api = TIMEZONE_TEMPLATE.format(endpoints.url('google'))
     params = {
         'location': '{},{}'.format(lat, lng),
         'timestamp': int(time.time()),
         'sensor': 'false'
     }
-    r = requests.get(api, params=params).json()
+    r = transport.get(api, params=params).json()
 
     if r.get('status') == 'OK':
         return r
@@ -41,6 +46,16 @@ def timezone(lat, lng):
     raise Exception('Request failed')
 
 
+def geocode_async(location, deadline=None):
+    '''Start a geocode lookup; returns a transport.Future'''
+    return transport.submit(geocode, location, deadline=deadline)
+
+
+def timezone_async(lat, lng, deadline=None):
+    '''Start a timezone lookup; returns a transport.Future'''
+    return transport.submit(timezone, lat, lng, deadline=deadline)
+
+
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
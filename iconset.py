@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+'''
+Build and install weather icon sets.
+
+An icon set is a directory of PNG files, one for each condition name the
+weather services use (like 'sunny' or 'nt_chancerain'), and a manifest.json
+that maps each name to the file to show for it. Many sets use the same art
+for several conditions (such as 'sunny' and 'clear'), so each distinct image
+is only stored once and the manifest points every name that uses it at the
+same file.
+'''
+
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+MANIFEST = 'manifest.json'
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+
+class IconSetError(Exception):
+    pass
+
+
+def content_hash(path):
+    '''Return a hash of a file's contents'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def validate(path):
+    '''Raise an IconSetError if a file isn't a PNG image'''
+    with open(path, 'rb') as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            raise IconSetError('{} is not a PNG image'.format(path))
+
+
+def load_manifest(set_dir):
+    '''Return the {name: file} manifest of a set, or None if it has none'''
+    path = os.path.join(set_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rt') as f:
+        return json.load(f)
+
+
+def _write_manifest(set_dir, manifest):
+    with open(os.path.join(set_dir, MANIFEST), 'wt') as f:
+        json.dump(manifest, f, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        f.write('\n')
+
+
+def _group(files):
+    '''
+    Validate the images in a {name: path} dict and group the names by image
+    content. Returns a {hash: [name, ...]} dict with sorted name lists.
+    '''
+    groups = {}
+    for name, path in files.items():
+        validate(path)
+        groups.setdefault(content_hash(path), []).append(name)
+    for names in groups.values():
+        names.sort()
+    return groups
+
+
+def _keeper(names):
+    '''
+    Return the name whose file is kept for a group of identical images.
+    Day names are preferred to night ('nt_') ones, so a day condition is
+    never shown with a night-named file when both use the same art.
+    '''
+    return min(names, key=lambda name: (name.startswith('nt_'), name))
+
+
+def build(set_dir):
+    '''
+    Deduplicate the images in an installed set and write its manifest.
+
+    Of each group of identical images, only the file for the group's
+    _keeper name is kept and the rest are removed. Returns the manifest.
+    '''
+    manifest = load_manifest(set_dir) or {}
+    files = {}
+    for filename in os.listdir(set_dir):
+        name, ext = os.path.splitext(filename)
+        if ext == '.png':
+            files[name] = os.path.join(set_dir, filename)
+    # names that already point at another file keep doing so
+    for name, filename in manifest.items():
+        if name not in files:
+            files[name] = os.path.join(set_dir, filename)
+
+    manifest = {}
+    for names in _group(files).values():
+        keeper = _keeper(names)
+        keep = '{}.png'.format(keeper)
+        if not os.path.exists(os.path.join(set_dir, keep)):
+            shutil.copyfile(files[keeper], os.path.join(set_dir, keep))
+        for name in names:
+            manifest[name] = keep
+    for path in set(files.values()):
+        if os.path.basename(path) not in manifest.values():
+            os.remove(path)
+
+    _write_manifest(set_dir, manifest)
+    return manifest
+
+
+def install(files, dest, info=None):
+    '''
+    Install a set from a {name: source path} dict of images into dest.
+
+    The set is assembled next to dest and moved into place in one step, so
+    a partly copied set is never visible. An existing set at dest is
+    replaced. Returns the manifest.
+    '''
+    parent = os.path.dirname(os.path.abspath(dest))
+    staging = tempfile.mkdtemp(dir=parent, prefix='.iconset-')
+    os.chmod(staging, 0755)
+    try:
+        manifest = {}
+        for names in _group(files).values():
+            keeper = _keeper(names)
+            filename = '{}.png'.format(keeper)
+            shutil.copyfile(files[keeper], os.path.join(staging, filename))
+            for name in names:
+                manifest[name] = filename
+
+        _write_manifest(staging, manifest)
+        if info:
+            with open(os.path.join(staging, 'info.json'), 'wt') as f:
+                json.dump(info, f, indent=2, separators=(',', ': '))
+                f.write('\n')
+
+        if os.path.exists(dest):
+            old = staging + '-old'
+            os.rename(dest, old)
+            os.rename(staging, dest)
+            shutil.rmtree(old)
+        else:
+            os.rename(staging, dest)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Deduplicate installed icon sets '
+                            'and write their manifests')
+    parser.add_argument('sets', nargs='+', help='Icon set directories')
+    args = parser.parse_args()
+
+    for set_dir in args.sets:
+        manifest = build(set_dir)
+        print '{}: {} names, {} images'.format(
+            set_dir, len(manifest), len(set(manifest.values())))
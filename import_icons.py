@@ -6,10 +6,13 @@ Convert a weather icon set for whatever uses these standard numbers to a
 Weather Underground-compatible icon set.
 
 Additional, 'wind' is included for forecast.io.
+
+Images shared by several names are only copied once, and the set is written
+with a manifest mapping each name to its image (see iconset.py).
 '''
 
+import iconset
 import os.path
-from os import system
 from argparse import ArgumentParser
 
 MAPPING = {
@@ -52,9 +55,14 @@ MAPPING = {
 parser = ArgumentParser()
 parser.add_argument('source', help='Source directory')
 parser.add_argument('dest', help='Destination directory')
+parser.add_argument('-d', '--description', help='Description of the set')
 args = parser.parse_args()
 
+files = {}
 for name in MAPPING.keys():
-    source = os.path.join(args.source, '{}.png'.format(MAPPING[name]))
-    dest = os.path.join(args.dest, '{}.png'.format(name))
-    system("cp '{}' '{}'".format(source, dest))
+    files[name] = os.path.join(args.source, '{}.png'.format(MAPPING[name]))
+
+info = {'description': args.description} if args.description else None
+manifest = iconset.install(files, args.dest, info)
+print 'Installed {} names using {} images'.format(
+    len(manifest), len(set(manifest.values())))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+'''
+Pull selected values out of a JSON document as it streams in.
+
+extract() reads a document from an iterator of text chunks (such as
+requests' Response.iter_content) and returns only the values at the requested
+dotted paths. Everything else is scanned past without being decoded, and text
+that's been scanned is discarded, so memory use depends on the size of the
+wanted values rather than the size of the whole document. select() picks the
+same values out of a document that has already been decoded.
+'''
+
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+SCALAR = re.compile(r'[^,\]}\s]+')
+# a run of complete strings and anything other than brackets
+CONTENT = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*', re.DOTALL)
+
+# discard scanned text once this much has built up
+TRIM_SIZE = 65536
+
+
+class _Reader(object):
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        # text before the mark is still needed and can't be discarded
+        self.mark = None
+
+    def more(self):
+        '''Read another chunk; returns False at the end of the document'''
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            if chunk:
+                if self.mark is None and self.pos > TRIM_SIZE:
+                    self.buf = self.buf[self.pos:]
+                    self.pos = 0
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def skip_ws(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.more():
+                return
+
+    def peek(self):
+        self.skip_ws()
+        if self.pos >= len(self.buf):
+            raise ValueError('Unexpected end of JSON document')
+        return self.buf[self.pos]
+
+    def next(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, char):
+        found = self.next()
+        if found != char:
+            raise ValueError('Expected {!r} but found {!r} at {}'.format(
+                char, found, self.pos))
+
+    def _match(self, regex):
+        '''Match a token that must be followed by more text'''
+        while True:
+            match = regex.match(self.buf, self.pos)
+            if match and (match.end() < len(self.buf) or self.eof):
+                return match
+            if not self.more():
+                if match:
+                    return match
+                raise ValueError('Invalid JSON at {}'.format(self.pos))
+
+    def read_string(self):
+        self.peek()
+        match = self._match(STRING)
+        self.pos = match.end()
+        return json.loads(match.group())
+
+    def skip_value(self):
+        char = self.peek()
+        if char == '"':
+            self.pos = self._match(STRING).end()
+        elif char in '{[':
+            self._skip_container()
+        else:
+            self.pos = self._match(SCALAR).end()
+
+    def _skip_container(self):
+        depth = 0
+        while True:
+            self.pos = CONTENT.match(self.buf, self.pos).end()
+            # the content match stops at a bracket, at the end of the
+            # buffer, or at a string that continues into the next chunk
+            if self.pos >= len(self.buf) or self.buf[self.pos] == '"':
+                if not self.more():
+                    raise ValueError('Unexpected end of JSON document')
+                continue
+
+            char = self.buf[self.pos]
+            self.pos += 1
+            if char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def read_value(self):
+        '''Decode the next value'''
+        self.peek()
+        start = self.pos
+        self.mark = start
+        try:
+            self.skip_value()
+            return json.loads(self.buf[start:self.pos])
+        finally:
+            self.mark = None
+
+
+def _compile(paths):
+    '''
+    Turn dotted paths into a tree of {key: subtree}, where a subtree of None
+    means the whole value is wanted.
+    '''
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            if node.get(part, {}) is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def _read_object(reader, wanted, top=False):
+    result = {}
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.next()
+        return result
+
+    while True:
+        key = reader.read_string()
+        reader.expect(':')
+        if key in wanted:
+            subtree = wanted[key]
+            if subtree is None or reader.peek() != '{':
+                result[key] = reader.read_value()
+            else:
+                result[key] = _read_object(reader, subtree)
+            if top and len(result) == len(wanted):
+                # everything wanted has been found
+                return result
+        else:
+            reader.skip_value()
+
+        char = reader.next()
+        if char == '}':
+            return result
+        if char != ',':
+            raise ValueError('Expected "," or "}}" but found {!r}'.format(
+                char))
+
+
+def _select(obj, wanted):
+    result = {}
+    for key, subtree in wanted.items():
+        if key in obj:
+            value = obj[key]
+            if subtree is not None and isinstance(value, dict):
+                value = _select(value, subtree)
+            result[key] = value
+    return result
+
+
+def select(data, paths):
+    '''
+    Return a dict with only the values at some dotted paths of an already
+    decoded JSON object, like extract() would
+    '''
+    return _select(data, _compile(paths))
+
+
+def extract(chunks, paths):
+    '''
+    Return a dict with only the values at some dotted paths (like
+    'daily.data') of the JSON object read from an iterator of chunks.
+
+    Reading stops as soon as every top-level value that's wanted has been
+    found.
+    '''
+    reader = _Reader(chunks)
+    return _read_object(reader, _compile(paths), top=True)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+'''
+A dict-like JSON file that is loaded lazily and written back all at once.
+
+Nothing is read from disk until a value is first needed, default values live
+only in memory, and any number of changes are coalesced into a single atomic
+write when the file is flushed (which happens automatically at exit).
+
+Lookups fall back to the defaults, but "key in file" is only true for values
+actually stored, so code can still tell whether a setting was ever made.
+'''
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+
+LOG = logging.getLogger(__name__)
+
+
+class LazyJsonFile(object):
+
+    def __init__(self, path, defaults=None, flush_at_exit=True):
+        self.path = path
+        self.defaults = defaults or {}
+        self._data = None
+        self._dirty = False
+        if flush_at_exit:
+            atexit.register(self.flush)
+
+    @property
+    def data(self):
+        '''The values actually stored in the file (no defaults)'''
+        if self._data is None:
+            self._data = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'rt') as jfile:
+                        self._data = json.load(jfile)
+                except ValueError:
+                    LOG.warn('ignoring invalid JSON in %s', self.path)
+        return self._data
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        if key in self.data:
+            return self.data[key]
+        return self.defaults[key]
+
+    def __setitem__(self, key, value):
+        data = self.data
+        if key in data and data[key] is not value and data[key] == value:
+            return
+        data[key] = value
+        self._dirty = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self._dirty = True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = set(self.defaults.keys())
+        keys.update(self.data.keys())
+        return list(keys)
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def touch(self):
+        '''Mark the file as modified after changing a nested value in place'''
+        self._dirty = True
+
+    def reload(self):
+        '''Discard the in-memory state and re-read the file on next access'''
+        self._data = None
+        self._dirty = False
+
+    def flush(self):
+        '''Atomically write the stored values if anything has changed'''
+        if not self._dirty:
+            return
+
+        dirname = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wt') as tfile:
+                json.dump(self._data, tfile, indent=2)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._dirty = False
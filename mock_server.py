@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+
+'''
+A local stand-in for the Forecast.io, Weather Underground and Google Maps
+APIs.
+
+Responses are generated from the requested location and the current day, so
+repeated requests get the same data while different places get different
+weather. Forecasts carry an ETag and a Cache-Control max-age, and
+conditional requests for unchanged forecasts get a 304. Latency, random
+server errors, invalid keys and per-key rate limits can all be simulated.
+Point the workflow at the server with JC_WEATHER_API_BASE (see
+endpoints.py), for example:
+
+    ./mock_server.py --port 8080 --latency 200 --error-rate 0.05
+    JC_WEATHER_API_BASE=http://localhost:8080 ./alfred_weather.py ...
+'''
+
+import calendar
+import forecastdiff
+import json
+import math
+import pytz
+import random
+import re
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from datetime import datetime, timedelta
+
+# name, region, country, latitude, longitude, timezone
+CITIES = (
+    ('Boston', 'MA', 'USA', 42.3601, -71.0589, 'America/New_York'),
+    ('New York', 'NY', 'USA', 40.7128, -74.0060, 'America/New_York'),
+    ('Chicago', 'IL', 'USA', 41.8781, -87.6298, 'America/Chicago'),
+    ('Denver', 'CO', 'USA', 39.7392, -104.9903, 'America/Denver'),
+    ('Los Angeles', 'CA', 'USA', 34.0522, -118.2437, 'America/Los_Angeles'),
+    ('San Francisco', 'CA', 'USA', 37.7749, -122.4194,
+     'America/Los_Angeles'),
+    ('Seattle', 'WA', 'USA', 47.6062, -122.3321, 'America/Los_Angeles'),
+    ('London', 'England', 'UK', 51.5074, -0.1278, 'Europe/London'),
+    ('Paris', 'Ile-de-France', 'France', 48.8566, 2.3522, 'Europe/Paris'),
+    ('Berlin', 'Berlin', 'Germany', 52.5200, 13.4050, 'Europe/Berlin'),
+    ('Tokyo', 'Tokyo', 'Japan', 35.6762, 139.6503, 'Asia/Tokyo'),
+    ('Sydney', 'NSW', 'Australia', -33.8688, 151.2093, 'Australia/Sydney'),
+)
+
+CONDITIONS = (
+    ('clear', 'clear-day', 'Clear'),
+    ('partlycloudy', 'partly-cloudy-day', 'Partly Cloudy'),
+    ('mostlycloudy', 'cloudy', 'Mostly Cloudy'),
+    ('cloudy', 'cloudy', 'Overcast'),
+    ('chancerain', 'rain', 'Chance of Rain'),
+    ('rain', 'rain', 'Rain'),
+    ('tstorms', 'rain', 'Thunderstorms'),
+    ('snow', 'snow', 'Snow'),
+    ('fog', 'fog', 'Fog'),
+)
+
+DAYS = 10
+HOURS = 48
+
+
+class Behavior(object):
+
+    '''How the server should misbehave'''
+
+    def __init__(self, latency=0, jitter=0, error_rate=0.0, rate_limit=0,
+                 invalid_keys=(), max_age=300):
+        self.latency = latency
+        self.max_age = max_age
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.invalid_keys = set(invalid_keys)
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def delay(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+    def over_limit(self, key):
+        '''Count a request for a key and return True if it's over the limit'''
+        if not self.rate_limit:
+            return False
+        minute = int(time.time() / 60)
+        with self._lock:
+            count_minute, count = self._requests.get(key, (minute, 0))
+            if count_minute != minute:
+                count = 0
+            count += 1
+            self._requests[key] = (minute, count)
+        return count > self.rate_limit
+
+
+def find_city(query):
+    query = query.lower()
+    for city in CITIES:
+        if city[0].lower() == query.split(',')[0].strip():
+            return city
+    return None
+
+
+def coordinates(query):
+    '''Return plausible coordinates for any place name'''
+    city = find_city(query)
+    if city:
+        return city[3], city[4]
+    rng = random.Random(query.lower())
+    return round(rng.uniform(25, 50), 4), round(rng.uniform(-125, -70), 4)
+
+
+def timezone_for(lat, lng):
+    for city in CITIES:
+        if abs(city[3] - lat) < 0.5 and abs(city[4] - lng) < 0.5:
+            return city[5]
+    offset = int(round(lng / 15.0))
+    if offset == 0:
+        return 'Etc/GMT'
+    # the Etc zones have inverted signs
+    return 'Etc/GMT{:+d}'.format(-offset)
+
+
+def _weather_rng(lat, lng, day):
+    return random.Random('{:.2f},{:.2f},{}'.format(lat, lng, day))
+
+
+def _daily(lat, lng, day):
+    '''Generate one day of weather for a place'''
+    rng = _weather_rng(lat, lng, day.toordinal())
+    # colder towards the poles and in the winter (of the right hemisphere)
+    season = math.cos((day.timetuple().tm_yday - 200) * 2 * math.pi / 365)
+    if lat < 0:
+        season = -season
+    base = 30 - abs(lat) * 0.4 + season * 12
+    hi = base + rng.uniform(0, 8)
+    lo = hi - rng.uniform(5, 12)
+    wund_icon, fio_icon, summary = rng.choice(CONDITIONS)
+    return {
+        'hi': hi,
+        'lo': lo,
+        'precip': rng.choice((0, 0, 10, 20, 30, 40, 60, 80, 90)),
+        'humidity': rng.randint(25, 95),
+        'wind': rng.uniform(0, 30),
+        'wund_icon': wund_icon,
+        'fio_icon': fio_icon,
+        'summary': summary
+    }
+
+
+def _local_midnight(tz):
+    '''Return the date and the epoch time of the last midnight in a zone'''
+    zone = pytz.timezone(tz)
+    today = datetime.now(zone).date()
+    midnight = zone.localize(datetime(today.year, today.month, today.day))
+    return today, calendar.timegm(midnight.utctimetuple())
+
+
+def _f(celsius):
+    return celsius * 9 / 5.0 + 32
+
+
+def forecastio_response(lat, lng, units):
+    tz = timezone_for(lat, lng)
+    today, midnight = _local_midnight(tz)
+    convert = _f if units == 'us' else (lambda c: c)
+
+    days = []
+    for i in range(8):
+        day = _daily(lat, lng, today + timedelta(days=i))
+        start = midnight + i * 86400
+        days.append({
+            'time': start,
+            'summary': '{} throughout the day.'.format(day['summary']),
+            'icon': day['fio_icon'],
+            'sunriseTime': start + 6 * 3600 + 1200,
+            'sunsetTime': start + 18 * 3600 + 600,
+            'temperatureMax': round(convert(day['hi']), 2),
+            'temperatureMin': round(convert(day['lo']), 2),
+            'apparentTemperatureMax': round(convert(day['hi'] + 1), 2),
+            'apparentTemperatureMin': round(convert(day['lo'] - 2), 2),
+            'precipProbability': day['precip'] / 100.0,
+            'humidity': day['humidity'] / 100.0,
+            'windSpeed': round(day['wind'], 2),
+            'pressure': 1013.2,
+            'cloudCover': 0.4
+        })
+
+    today_weather = _daily(lat, lng, today)
+    hours = []
+    for i in range(HOURS):
+        hours.append({
+            'time': midnight + i * 3600,
+            'summary': today_weather['summary'],
+            'icon': today_weather['fio_icon'],
+            'temperature': round(convert(today_weather['lo'] + i % 24 / 3.0),
+                                 2),
+            'apparentTemperature': round(
+                convert(today_weather['lo'] + i % 24 / 3.0 - 1), 2),
+            'humidity': today_weather['humidity'] / 100.0,
+            'windSpeed': round(today_weather['wind'], 2),
+            'precipProbability': today_weather['precip'] / 100.0
+        })
+
+    now = int(time.time())
+    current = dict(hours[min(int((now - midnight) / 3600), HOURS - 1)])
+    current['time'] = now
+
+    return {
+        'latitude': lat,
+        'longitude': lng,
+        'timezone': tz,
+        'offset': 0,
+        'currently': current,
+        'minutely': {
+            'summary': today_weather['summary'],
+            'data': [{'time': now + i * 60, 'precipIntensity': 0}
+                     for i in range(61)]
+        },
+        'hourly': {'summary': today_weather['summary'], 'data': hours},
+        'daily': {'summary': today_weather['summary'], 'data': days},
+        'flags': {'units': units, 'sources': ['mock']}
+    }
+
+
+def wunderground_response(lat, lng):
+    today, midnight = _local_midnight(timezone_for(lat, lng))
+    days = []
+    for i in range(DAYS):
+        fdate = today + timedelta(days=i)
+        day = _daily(lat, lng, fdate)
+        days.append({
+            'date': {
+                'epoch': str(midnight + i * 86400),
+                'day': fdate.day,
+                'month': fdate.month,
+                'year': fdate.year,
+                'weekday': fdate.strftime('%A')
+            },
+            'period': i + 1,
+            'high': {'fahrenheit': str(int(round(_f(day['hi'])))),
+                     'celsius': str(int(round(day['hi'])))},
+            'low': {'fahrenheit': str(int(round(_f(day['lo'])))),
+                    'celsius': str(int(round(day['lo'])))},
+            'conditions': day['summary'],
+            'icon': day['wund_icon'],
+            'icon_url': 'http://icons.wxug.com/i/c/k/{}.gif'.format(
+                day['wund_icon']),
+            'pop': day['precip'],
+            'avehumidity': day['humidity'],
+            'avewind': {'mph': int(day['wind'] / 1.609),
+                        'kph': int(day['wind'])}
+        })
+
+    txt = [{'period': i, 'icon': d['icon'], 'title': d['date']['weekday'],
+            'fcttext': '{}. High of {}F.'.format(d['conditions'],
+                                                 d['high']['fahrenheit'])}
+           for i, d in enumerate(days)]
+
+    now = _daily(lat, lng, today)
+    temp = (now['hi'] + now['lo']) / 2
+    return {
+        'response': {
+            'version': '0.1',
+            'features': {'conditions': 1, 'alerts': 1, 'astronomy': 1,
+                         'forecast10day': 1}
+        },
+        'current_observation': {
+            'display_location': {'latitude': str(lat),
+                                 'longitude': str(lng)},
+            'observation_epoch': str(int(time.time())),
+            'weather': now['summary'],
+            'icon': now['wund_icon'],
+            'icon_url': 'http://icons.wxug.com/i/c/k/{}.gif'.format(
+                now['wund_icon']),
+            'temp_f': round(_f(temp), 1),
+            'temp_c': round(temp, 1),
+            'feelslike_f': str(round(_f(temp - 1), 1)),
+            'feelslike_c': str(round(temp - 1, 1)),
+            'relative_humidity': '{}%'.format(now['humidity']),
+            'wind_mph': round(now['wind'] / 1.609, 1),
+            'wind_kph': round(now['wind'], 1)
+        },
+        'alerts': [],
+        'moon_phase': {
+            'percentIlluminated': '50',
+            'sunrise': {'hour': '6', 'minute': '20'},
+            'sunset': {'hour': '18', 'minute': '10'}
+        },
+        'forecast': {
+            'txt_forecast': {'forecastday': txt},
+            'simpleforecast': {'forecastday': days}
+        }
+    }
+
+
+def autocomplete_response(query):
+    query = query.lower()
+    results = []
+    for name, region, country, lat, lng, tz in CITIES:
+        if name.lower().startswith(query):
+            results.append({
+                'name': '{}, {}'.format(name, region),
+                'type': 'city',
+                'c': country,
+                'tz': tz,
+                'lat': str(lat),
+                'lon': str(lng),
+                'll': '{} {}'.format(lat, lng)
+            })
+    return {'RESULTS': results}
+
+
+def geocode_response(address):
+    lat, lng = coordinates(address)
+    city = find_city(address)
+    name = '{}, {}, {}'.format(*city[:3]) if city else address
+    return {
+        'status': 'OK',
+        'results': [{
+            'formatted_address': name,
+            'geometry': {'location': {'lat': lat, 'lng': lng}}
+        }]
+    }
+
+
+def timezone_response(location):
+    lat, lng = [float(v) for v in location.split(',')]
+    tz = timezone_for(lat, lng)
+    return {
+        'status': 'OK',
+        'timeZoneId': tz,
+        'timeZoneName': tz,
+        'rawOffset': 0,
+        'dstOffset': 0
+    }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    FORECASTIO = re.compile(r'^/forecastio/forecast/([^/]+)/'
+                            r'(-?[\d.]+),(-?[\d.]+)$')
+    WUNDERGROUND = re.compile(r'^/wunderground/api/([^/]+)/.*/q/'
+                              r'(-?[\d.]+),(-?[\d.]+)\.json$')
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_forecast(self, service, data):
+        '''Send a forecast, or a 304 if the client already has it'''
+        normalized = forecastdiff.normalize(service, data)
+        etag = '"{}"'.format(forecastdiff.digest(normalized))
+        max_age = 'max-age={}'.format(self.server.behavior.max_age)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', max_age)
+            self.end_headers()
+            return
+
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', max_age)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        behavior = self.server.behavior
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        path = url.path
+
+        behavior.delay()
+        if behavior.should_fail():
+            self.send_json({'error': 'Internal server error'}, 500)
+            return
+
+        match = self.FORECASTIO.match(path)
+        if match:
+            key, lat, lng = match.groups()
+            if key in behavior.invalid_keys:
+                self.send_json({'error': 'permission denied'}, 403)
+            elif behavior.over_limit(key):
+                self.send_json({'error': 'daily usage limit exceeded'}, 403)
+            else:
+                data = forecastio_response(float(lat), float(lng),
+                                           params.get('units', 'us'))
+                for block in params.get('exclude', '').split(','):
+                    data.pop(block, None)
+                self.send_forecast('fio', data)
+            return
+
+        match = self.WUNDERGROUND.match(path)
+        if match:
+            key, lat, lng = match.groups()
+            if key in behavior.invalid_keys:
+                self.send_json({'response': {'error': {
+                    'type': 'keynotfound',
+                    'description': 'this key does not exist'}}})
+            elif behavior.over_limit(key):
+                self.send_json({'response': {'error': {
+                    'type': 'invalidkey',
+                    'description': 'rate limit exceeded'}}})
+            else:
+                self.send_forecast('wund', wunderground_response(
+                    float(lat), float(lng)))
+            return
+
+        if path == '/autocomplete/aq':
+            self.send_json(autocomplete_response(params.get('query', '')))
+        elif path == '/google/maps/api/geocode/json':
+            if behavior.over_limit('google'):
+                self.send_json({'status': 'OVER_QUERY_LIMIT', 'results': []})
+            else:
+                self.send_json(geocode_response(params.get('address', '')))
+        elif path == '/google/maps/api/timezone/json':
+            if behavior.over_limit('google'):
+                self.send_json({'status': 'OVER_QUERY_LIMIT'})
+            else:
+                self.send_json(timezone_response(params.get('location',
+                                                            '0,0')))
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, behavior, verbose=False):
+        HTTPServer.__init__(self, address, MockRequestHandler)
+        self.behavior = behavior
+        self.verbose = verbose
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=8080)
+    parser.add_argument('-H', '--host', default='127.0.0.1')
+    parser.add_argument('-l', '--latency', type=float, default=0,
+                        help='Mean response latency in milliseconds')
+    parser.add_argument('-j', '--jitter', type=float, default=0,
+                        help='Random latency variation in milliseconds')
+    parser.add_argument('-e', '--error-rate', type=float, default=0,
+                        help='Fraction of requests that fail with a 500')
+    parser.add_argument('-r', '--rate-limit', type=int, default=0,
+                        help='Requests allowed per key per minute')
+    parser.add_argument('-i', '--invalid-key', action='append', default=[],
+                        help='An API key to reject')
+    parser.add_argument('-m', '--max-age', type=int, default=300,
+                        help='Seconds forecasts stay fresh')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    behavior = Behavior(args.latency, args.jitter, args.error_rate,
+                        args.rate_limit, args.invalid_key, args.max_age)
+    server = MockServer((args.host, args.port), behavior, args.verbose)
+    print 'Serving mock weather APIs on http://{}:{}'.format(args.host,
+                                                             args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
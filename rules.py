@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+'''
+User-defined rules about the forecast, like "precip > 60% tomorrow" or
+"low below 0C in next 3 days at Boston".
+
+A rule is a condition on one of a day's values, an optional window of days
+and an optional location:
+
+    <field> <comparison> <number>[unit] [today | tomorrow | in next N days]
+        [at <location>]
+
+The fields are high, low, precip, humidity and wind; comparisons are >, >=,
+<, <=, =, above, over, below and under. Temperatures may be given in C or F
+and wind speeds in mph or kph whatever the configured units are. A rule
+without a location, or with the location "home", is about the default
+location.
+
+Rules are evaluated incrementally. update() is given each normalized
+forecast as it's loaded and keeps, per location and date, a digest of the
+day's values and the rules whose conditions hold for it. Only days whose
+values changed are evaluated again, and a location is skipped entirely if
+the digest of its whole forecast matches the one it was last evaluated
+against, however that forecast was loaded. Windows are applied when the
+results are read, so stored results stay valid as days pass.
+'''
+
+import hashlib
+import json
+import re
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from gazetteer import search_key
+
+HOME = 'home'
+
+FIELDS = {
+    'high': 'temp_hi',
+    'low': 'temp_lo',
+    'precip': 'precip',
+    'humidity': 'humidity',
+    'wind': 'wind',
+}
+
+COMPARISONS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '=': lambda a, b: a == b,
+    'above': lambda a, b: a > b,
+    'over': lambda a, b: a > b,
+    'below': lambda a, b: a < b,
+    'under': lambda a, b: a < b,
+}
+
+RULE_RE = re.compile(
+    ur'^(?P<field>{})\s*(?P<op>>=|<=|>|<|=|above|over|below|under)\s*'
+    ur'(?P<value>-?\d+(?:\.\d+)?)\s*(?P<unit>%|\xb0?[cf]|mph|kph|km/h)?'
+    ur'(?:\s+(?P<when>today|tomorrow|in (?:the )?next (?P<days>\d+) days?))?'
+    ur'(?:\s+at\s+(?P<location>.+))?$'.format('|'.join(FIELDS)),
+    re.IGNORECASE | re.UNICODE)
+
+Rule = namedtuple('Rule', ('text', 'field', 'op', 'value', 'unit', 'first',
+                           'last', 'location'))
+
+
+class RuleError(Exception):
+    pass
+
+
+def parse(text):
+    '''Return the Rule for some text, or raise a RuleError'''
+    text = u' '.join(text.split())
+    match = RULE_RE.match(text)
+    if not match:
+        raise RuleError(u'Not a rule: {}'.format(text))
+
+    when = (match.group('when') or '').lower()
+    if when == 'today':
+        first, last = 0, 0
+    elif when == 'tomorrow':
+        first, last = 1, 1
+    elif when:
+        days = int(match.group('days'))
+        if days < 1:
+            raise RuleError(u'A rule needs at least one day: {}'.format(text))
+        first, last = 0, days - 1
+    else:
+        first, last = 0, None
+
+    unit = (match.group('unit') or '').lower().lstrip(u'\xb0')
+    location = match.group('location')
+    if location and search_key(location) == HOME:
+        location = None
+    return Rule(text, match.group('field').lower(), match.group('op').lower(),
+                float(match.group('value')), unit.replace('km/h', 'kph'),
+                first, last, location)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def threshold(rule, units):
+    '''Return a rule's value in the given unit system'''
+    value = rule.value
+    if rule.field in ('high', 'low'):
+        if rule.unit == 'c' and units == 'us':
+            value = value * 9.0 / 5 + 32
+        elif rule.unit == 'f' and units == 'si':
+            value = (value - 32) * 5.0 / 9
+    elif rule.field == 'wind':
+        if rule.unit == 'kph' and units == 'us':
+            value *= 0.621371
+        elif rule.unit == 'mph' and units == 'si':
+            value /= 0.621371
+    return value
+
+
+def holds(rule, day, units):
+    '''True if a rule's condition holds for a day of a normalized forecast'''
+    value = _number(day.get(FIELDS[rule.field]))
+    if value is None:
+        return False
+    return COMPARISONS[rule.op](value, threshold(rule, units))
+
+
+def applies(rule, location, default):
+    '''True if a rule is about a location, given the default location'''
+    if rule.location is None:
+        return default is not None and location['name'] == default['name']
+    key = search_key(rule.location)
+    return key in (search_key(location['name']),
+                   search_key(location.get('short_name', '')))
+
+
+def _digest(value):
+    text = json.dumps(value, sort_keys=True, separators=(',', ':'),
+                      default=lambda v: v.isoformat())
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def update(state, rules, location, default, forecast, context):
+    '''
+    Evaluate the rules about a location against its normalized forecast
+    days, recording the results in state (a dict-like store keyed by
+    location name). context is anything else the results depend on, like
+    the service and units. If the location was last evaluated against the
+    same forecast with the same rules and context, nothing is done.
+    '''
+    units = context['units']
+    rules = [r for r in rules if applies(r, location, default)]
+    rules_key = _digest([[r.text for r in rules], context])
+    entry = state.get(location['name']) or {}
+    reusable = entry.get('rules') == rules_key
+
+    digests = [(day['date'].isoformat(),
+                _digest(dict((f, day.get(f)) for f in FIELDS.values())))
+               for day in forecast]
+    forecast_key = _digest(digests)
+
+    if reusable and entry.get('forecast') == forecast_key:
+        # still current, as of now
+        entry['at'] = time.time()
+        state[location['name']] = entry
+        return
+
+    old_days = entry.get('days', {}) if reusable else {}
+    days = {}
+    for day, (key, digest) in zip(forecast, digests):
+        old = old_days.get(key)
+        if old and old['digest'] == digest:
+            days[key] = old
+        else:
+            days[key] = {
+                'digest': digest,
+                'matched': [r.text for r in rules if holds(r, day, units)]
+            }
+
+    state[location['name']] = {
+        'short_name': location.get('short_name', location['name']),
+        'at': time.time(),
+        'rules': rules_key,
+        'forecast': forecast_key,
+        'days': days
+    }
+
+
+def matches(state, rules, today, max_age, days=None, names=None):
+    '''
+    Return (rule, short name, date string) for each rule and location where
+    the rule holds on some day within its window, giving the first such day,
+    ordered by date. Only results no more than max_age seconds old are used.
+    Windows are clipped to the first few days if days is given, and only the
+    locations with the given names are included if names is.
+    '''
+    by_text = dict((r.text, r) for r in rules)
+    now = time.time()
+    first = {}
+    for name in (state.keys() if names is None else names):
+        entry = state.get(name)
+        if not entry or now - entry.get('at', 0) > max_age:
+            continue
+        for day_key, day in entry['days'].items():
+            day_date = datetime.strptime(day_key, '%Y-%m-%d').date()
+            offset = (day_date - today).days
+            if days is not None and offset >= days:
+                continue
+            for text in day['matched']:
+                rule = by_text.get(text)
+                if rule is None or offset < rule.first:
+                    continue
+                if rule.last is not None and offset > rule.last:
+                    continue
+                key = (text, name)
+                if key not in first or day_key < first[key][2]:
+                    first[key] = (rule, entry['short_name'], day_key)
+    return sorted(first.values(), key=lambda m: (m[2], m[1], m[0].text))
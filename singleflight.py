@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+'''
+Cross-process single-flight for upstream requests.
+
+Processes that need the same thing (identified by a key) take an exclusive
+lock on a file named for that key. The first one makes the request while the
+others wait; when a waiting process gets the lock it can find the result in
+the shared cache instead of making the same request again.
+'''
+
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+LOG = logging.getLogger(__name__)
+
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+
+def lock_path(lock_dir, key):
+    '''Return the path of the lock file for a key'''
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    name = hashlib.md5(key).hexdigest()
+    return os.path.join(lock_dir, name + '.lock')
+
+
+def _open(lock_dir, key):
+    if not os.path.isdir(lock_dir):
+        try:
+            os.makedirs(lock_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    return os.open(lock_path(lock_dir, key), os.O_CREAT | os.O_RDWR, 0644)
+
+
+def _try_lock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+
+
+@contextmanager
+def flight(lock_dir, key, timeout=LOCK_TIMEOUT):
+    '''
+    Hold the lock for a key for the duration of a with block.
+
+    The value of the with statement is True if another process held the lock
+    first (so the caller should check for its result before doing the work
+    itself), or False if the lock was free. If the lock can't be had within
+    the timeout the block runs anyway, unlocked.
+    '''
+    fd = _open(lock_dir, key)
+    try:
+        waited = False
+        if not _try_lock(fd):
+            waited = True
+            give_up = time.time() + timeout
+            while not _try_lock(fd):
+                if time.time() > give_up:
+                    LOG.warn('gave up waiting for lock on %s', key)
+                    break
+                time.sleep(POLL_INTERVAL)
+        yield waited
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+
+
+def claim(lock_dir, key):
+    '''
+    Take the lock for a key without waiting, for work that doesn't fit in a
+    with block. Returns a handle to give to release(), or None if another
+    process holds the lock.
+    '''
+    fd = _open(lock_dir, key)
+    if _try_lock(fd):
+        return fd
+    os.close(fd)
+    return None
+
+
+def release(handle):
+    '''Release a lock taken with claim()'''
+    os.close(handle)
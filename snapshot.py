@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''
+Portable snapshots of the workflow's caches.
+
+A snapshot is a gzipped file holding a one-line JSON header followed by a
+compact JSON payload:
+
+    {"format": "jc-weather-cache", "version": 1, "created": ...,
+     "sha256": ..., "size": ...}
+    {...payload...}
+
+The header's checksum and size cover the payload bytes, so a truncated or
+corrupted snapshot is rejected before anything is loaded from it.
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+FORMAT = 'jc-weather-cache'
+VERSION = 1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write(path, payload):
+    '''Write a payload dict to a snapshot file'''
+    body = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    header = json.dumps({
+        'format': FORMAT,
+        'version': VERSION,
+        'created': int(time.time()),
+        'sha256': hashlib.sha256(body).hexdigest(),
+        'size': len(body)
+    }, sort_keys=True)
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+                gz.write(header + '\n')
+                gz.write(body)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def read(path):
+    '''Return the header and payload of a snapshot file'''
+    try:
+        with gzip.open(path, 'rb') as gz:
+            header = json.loads(gz.readline())
+            body = gz.read()
+    except (IOError, ValueError) as e:
+        raise SnapshotError('{} is not a cache snapshot: {}'.format(path, e))
+
+    if header.get('format') != FORMAT:
+        raise SnapshotError('{} is not a cache snapshot'.format(path))
+    if header.get('version') != VERSION:
+        raise SnapshotError('Unsupported snapshot version {}'.format(
+            header.get('version')))
+    if (len(body) != header.get('size') or
+            hashlib.sha256(body).hexdigest() != header.get('sha256')):
+        raise SnapshotError('{} is corrupt'.format(path))
+
+    return header, json.loads(body)
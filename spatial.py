@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+Grid bucketing of coordinates, so that cached data for one place can be found
+from any nearby place.
+
+Locations are identified by 'latitude,longitude' strings (the same keys the
+forecast cache uses) and are filed under the grid cell that contains them.
+Cells are as tall as the search radius, so a search only ever has to look at
+a cell and its immediate neighbors.
+'''
+
+import math
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+
+
+def distance(lat1, lng1, lat2, lng2):
+    '''Return the great-circle distance between two points in kilometers'''
+    lat1, lng1, lat2, lng2 = [math.radians(float(v))
+                              for v in (lat1, lng1, lat2, lng2)]
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_key(key):
+    '''Return the (latitude, longitude) of a location key'''
+    lat, lng = key.split(',')
+    return float(lat), float(lng)
+
+
+class GridIndex(object):
+
+    '''
+    A spatial index over a dict of {cell: [location key, ...]}
+
+    The dict is used (and modified) in place, so it can live inside a
+    JSON-backed cache. With a radius of 0 or less nothing is indexed and
+    nothing is nearby.
+    '''
+
+    def __init__(self, cells, radius_km):
+        self.cells = cells
+        self.radius = radius_km
+        self.degrees = radius_km / KM_PER_DEGREE if radius_km > 0 else None
+
+    def _cell(self, row, col):
+        return '{}:{}'.format(row, col)
+
+    def _position(self, lat, lng):
+        return (int(math.floor(lat / self.degrees)),
+                int(math.floor(lng / self.degrees)))
+
+    def add(self, key):
+        if not self.degrees:
+            return
+        row, col = self._position(*parse_key(key))
+        keys = self.cells.setdefault(self._cell(row, col), [])
+        if key not in keys:
+            keys.append(key)
+
+    def remove(self, key):
+        if not self.degrees:
+            return
+        row, col = self._position(*parse_key(key))
+        cell = self._cell(row, col)
+        if key in self.cells.get(cell, []):
+            self.cells[cell].remove(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def nearby(self, lat, lng):
+        '''
+        Return (distance, key) pairs for the indexed locations within the
+        radius of a point, nearest first.
+        '''
+        if not self.degrees:
+            return []
+        row, col = self._position(lat, lng)
+        # longitude degrees shrink towards the poles, so more columns may be
+        # needed to cover the radius
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        col_span = int(math.ceil(1 / cos_lat))
+
+        matches = []
+        for r in range(row - 1, row + 2):
+            for c in range(col - col_span, col + col_span + 1):
+                for key in self.cells.get(self._cell(r, c), ()):
+                    dist = distance(lat, lng, *parse_key(key))
+                    if dist <= self.radius:
+                        matches.append((dist, key))
+        return sorted(matches)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+'''
+The HTTP transport shared by the provider modules.
+
+Every request goes through one requests.Session, so connections to each API
+host are pooled and reused. Provider functions can also be run in a small,
+bounded pool of worker threads with submit(), which returns a Future that can
+be cancelled and waited on with a deadline. That lets independent lookups
+(a geocode and a forecast, or several forecasts) run at the same time.
+
+Responses can also be revalidated: validators() collects a response's ETag,
+Last-Modified and freshness lifetime, and conditional_headers() turns them
+into the headers that let the server answer a repeated request with a
+bodiless 304 Not Modified.
+'''
+
+import jsonstream
+import re
+import sys
+import threading
+import time
+import requests
+from collections import namedtuple
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = 10
+# JSON responses at least this large (or of unknown size) are decoded as they
+# stream in; smaller ones decode faster all at once
+STREAM_MIN_SIZE = 65536
+CHUNK_SIZE = 16384
+MAX_WORKERS = 8
+POOL_SIZE = 16
+
+MAX_AGE = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)', re.I)
+NO_CACHE = re.compile(r'(?:^|,)\s*(?:no-cache|no-store)\b', re.I)
+
+# the data from a conditional request (None if it hadn't changed) and the
+# validators for revalidating it
+Fetched = namedtuple('Fetched', ('data', 'validators'))
+
+_session = None
+_pool = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def session():
+    '''Return the shared, connection-pooling session'''
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE,
+                                  pool_maxsize=POOL_SIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+
+def _worker_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPool(MAX_WORKERS)
+    return _pool
+
+
+def get(url, params=None, headers=None, timeout=None, stream=False):
+    '''
+    Make a GET request with the shared session.
+
+    With stream=True the body isn't read until it's asked for, so it can be
+    processed with Response.iter_content.
+
+    When called from a function run with submit(), the request also has to
+    finish before that call's deadline.
+    '''
+    timeout = timeout or DEFAULT_TIMEOUT
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline passed before requesting '
+                                   '{}'.format(url))
+        timeout = min(timeout, remaining)
+    return session().get(url, params=params, headers=headers,
+                         timeout=timeout, stream=stream)
+
+
+def read_json(response, fields=None):
+    '''
+    Decode a JSON response made with stream=True, keeping only the values at
+    some dotted paths if fields are given.
+
+    Large responses are read with jsonstream.extract, which stops once it has
+    the wanted values. The rest of the body is still read so the connection
+    can go back to the pool.
+    '''
+    if not fields:
+        return response.json()
+
+    size = response.headers.get('Content-Length')
+    if size is not None and int(size) < STREAM_MIN_SIZE:
+        return jsonstream.select(response.json(), fields)
+
+    chunks = response.iter_content(CHUNK_SIZE)
+    data = jsonstream.extract(chunks, fields)
+    for chunk in chunks:
+        pass
+    return data
+
+
+def request_url(url, params=None):
+    '''Return the full URL a GET request with some params would use'''
+    return requests.Request('GET', url, params=params).prepare().url
+
+
+def _http_time(value):
+    parsed = parsedate_tz(value) if value else None
+    return mktime_tz(parsed) if parsed else None
+
+
+def validators(response, previous=None):
+    '''
+    Return the validators for a response as a dict with the request URL and
+    the response's 'etag', 'last_modified' and 'max_age' (the number of
+    seconds it stays fresh, from Cache-Control or Expires), any of which
+    may be None. Values a 304 response doesn't repeat are kept from the
+    previous validators.
+    '''
+    headers = response.headers
+    result = dict(previous or {})
+    result['url'] = response.request.url if response.request else None
+    if headers.get('ETag') or 'etag' not in result:
+        result['etag'] = headers.get('ETag')
+    if headers.get('Last-Modified') or 'last_modified' not in result:
+        result['last_modified'] = headers.get('Last-Modified')
+
+    max_age = None
+    cache_control = headers.get('Cache-Control', '')
+    match = MAX_AGE.search(cache_control)
+    if NO_CACHE.search(cache_control):
+        max_age = 0
+    elif match:
+        max_age = int(match.group(1))
+    elif headers.get('Expires'):
+        expires = _http_time(headers['Expires'])
+        date = _http_time(headers.get('Date')) or time.time()
+        max_age = max(int(expires - date), 0) if expires else 0
+    if max_age is not None or 'max_age' not in result:
+        result['max_age'] = max_age
+    return result
+
+
+def conditional_headers(url, params=None, validators=None):
+    '''
+    Return the headers to make a request conditional on the validators from
+    an earlier response to the same request
+    '''
+    headers = {}
+    if validators and validators.get('url') == request_url(url, params):
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+class Future(object):
+
+    '''The eventual result of a function run with submit()'''
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._event = threading.Event()
+        self._cancelled = False
+        self._result = None
+        self._exc_info = None
+
+    def cancel(self):
+        '''
+        Cancel the call. A call that hasn't started won't be run; the result
+        of one that has is discarded.
+        '''
+        if self._event.is_set():
+            return False
+        self._cancelled = True
+        self._event.set()
+        return True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        '''Wait for and return the result, re-raising any error'''
+        if self.deadline is not None:
+            remaining = max(self.deadline - time.time(), 0)
+            timeout = remaining if timeout is None else min(timeout,
+                                                            remaining)
+        if not self._event.wait(timeout):
+            raise DeadlineExceeded('Timed out waiting for a result')
+        if self._cancelled:
+            raise Cancelled()
+        if self._exc_info:
+            exc_type, exc_value, exc_tb = self._exc_info
+            raise exc_type, exc_value, exc_tb
+        return self._result
+
+    def _run(self, func, args, kwargs):
+        if self._cancelled:
+            return
+        _local.deadline = self.deadline
+        try:
+            result = func(*args, **kwargs)
+            if not self._cancelled:
+                self._result = result
+        except Exception:
+            if not self._cancelled:
+                self._exc_info = sys.exc_info()
+        finally:
+            _local.deadline = None
+            self._event.set()
+
+
+def submit(func, *args, **kwargs):
+    '''
+    Run func(*args, **kwargs) in the worker pool and return a Future.
+
+    A 'deadline' keyword argument, if given, is the time.time() by which the
+    call must finish; it's not passed to func.
+    '''
+    future = Future(kwargs.pop('deadline', None))
+    _worker_pool().apply_async(future._run, (func, args, kwargs))
+    return future
+
+
+def gather(futures, timeout=None):
+    '''Wait for several futures and return their results in order'''
+    return [f.result(timeout) for f in futures]
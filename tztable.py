@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+'''
+A compact table of UTC offset transitions for a few timezones, so times can
+be converted without loading pytz and its zoneinfo files.
+
+The table is a small JSON file covering a span of years:
+
+    {"version": 1, "start": ..., "end": ...,
+     "zones": {"Europe/Paris": {"times": [...], "offsets": [...],
+                                "infos": [[3600, 0, "CET"], ...]}}}
+
+times are the UTC timestamps at which each zone's offset changes (the first
+is the start of the table), offsets index the distinct (UTC offset, DST
+offset, name) infos in effect from each of them, and an offset is found by
+bisecting times. Times outside the table's span aren't covered; Zone
+methods raise OutOfRange for them so callers can fall back to pytz.
+'''
+
+import calendar
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from datetime import datetime, timedelta, tzinfo
+
+VERSION = 1
+
+# years before and after the current one that a table covers
+YEARS_BEFORE = 1
+YEARS_AFTER = 10
+
+
+class OutOfRange(Exception):
+    pass
+
+
+def _timestamp(dt):
+    '''Return the timestamp of a naive datetime taken as UTC'''
+    return calendar.timegm(dt.timetuple())
+
+
+class _Offset(tzinfo):
+
+    '''One fixed offset of a Zone'''
+
+    def __init__(self, zone, offset, dst, name):
+        self.zone = zone
+        self._offset = timedelta(seconds=offset)
+        self._dst = timedelta(seconds=dst)
+        self._name = str(name)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return self._dst
+
+    def tzname(self, dt):
+        return self._name
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.zone.name, self._name)
+
+
+class Zone(tzinfo):
+
+    '''
+    A timezone from a table. Like a pytz timezone, naive times are
+    attached to it with localize(), and converted times carry the fixed
+    offset in effect at that moment.
+    '''
+
+    def __init__(self, name, times, offsets, infos, end):
+        self.name = name
+        self._times = times
+        self._offsets = offsets
+        self._infos = [_Offset(self, *info) for info in infos]
+        self._end = end
+
+    def _info_at(self, stamp):
+        '''Return the _Offset in effect at a UTC timestamp'''
+        i = bisect_right(self._times, stamp) - 1
+        if i < 0 or stamp >= self._end:
+            raise OutOfRange('{} is not covered for {}'.format(
+                datetime.utcfromtimestamp(stamp), self.name))
+        return self._infos[self._offsets[i]]
+
+    def fromutc(self, dt):
+        info = self._info_at(_timestamp(dt))
+        return (dt + info.utcoffset(dt)).replace(tzinfo=info)
+
+    def localize(self, dt):
+        '''
+        Attach the zone to a naive local time. An ambiguous time is taken as
+        standard time, and a time skipped by a transition gets the offset
+        from before it.
+        '''
+        stamp = _timestamp(dt)
+        before = self._info_at(stamp - 86400)
+        after = self._info_at(stamp + 86400)
+        candidates = []
+        for info in (before, after):
+            offset = int(info.utcoffset(dt).total_seconds())
+            if self._info_at(stamp - offset) is info:
+                candidates.append(info)
+        if not candidates:
+            info = before
+        else:
+            info = min(candidates, key=lambda i: i.dst(dt))
+        return dt.replace(tzinfo=info)
+
+    def utcoffset(self, dt):
+        return self.localize(dt.replace(tzinfo=None)).utcoffset()
+
+    def dst(self, dt):
+        return self.localize(dt.replace(tzinfo=None)).dst()
+
+    def tzname(self, dt):
+        return self.localize(dt.replace(tzinfo=None)).tzname()
+
+    def __repr__(self):
+        return '<Zone {}>'.format(self.name)
+
+
+class Table(object):
+
+    '''A table file, read on first use'''
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._zones = {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = {'zones': {}}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'rt') as tfile:
+                        data = json.load(tfile)
+                    if data.get('version') == VERSION:
+                        self._data = data
+                except ValueError:
+                    pass
+        return self._data
+
+    def __contains__(self, name):
+        return name in self.data['zones']
+
+    def zone(self, name):
+        '''Return the Zone for a name, or None if the table doesn't have it'''
+        if name not in self._zones:
+            entry = self.data['zones'].get(name)
+            if entry is None:
+                return None
+            self._zones[name] = Zone(name, entry['times'], entry['offsets'],
+                                     entry['infos'], self.data['end'])
+        return self._zones[name]
+
+
+def _transitions(tz, start, end):
+    '''
+    Return the (timestamp, (offset, dst, name)) transitions of a pytz
+    timezone between two timestamps, starting with the info in effect at
+    start
+    '''
+    def info(offset, dst, name):
+        return (int(offset.total_seconds()), int(dst.total_seconds()),
+                name)
+
+    times = getattr(tz, '_utc_transition_times', None)
+    if not times:
+        return [(start, info(tz.utcoffset(None), tz.dst(None),
+                             tz.tzname(None)))]
+
+    stamps = [_timestamp(t) for t in times]
+    first = max(bisect_right(stamps, start) - 1, 0)
+    result = [(start, info(*tz._transition_info[first]))]
+    for stamp, tinfo in zip(stamps[first + 1:],
+                            tz._transition_info[first + 1:]):
+        if stamp >= end:
+            break
+        result.append((stamp, info(*tinfo)))
+    return result
+
+
+def build(names, now=None):
+    '''Return table data for some pytz timezone names'''
+    import pytz
+
+    now = now or datetime.utcnow()
+    start = _timestamp(datetime(now.year - YEARS_BEFORE, 1, 1))
+    end = _timestamp(datetime(now.year + YEARS_AFTER + 1, 1, 1))
+
+    zones = {}
+    for name in sorted(set(names)):
+        try:
+            tz = pytz.timezone(name)
+        except pytz.UnknownTimeZoneError:
+            continue
+        infos = []
+        times = []
+        offsets = []
+        for stamp, info in _transitions(tz, start, end):
+            if info not in infos:
+                infos.append(info)
+            index = infos.index(info)
+            if offsets and offsets[-1] == index:
+                continue
+            times.append(stamp)
+            offsets.append(index)
+        zones[name] = {'times': times, 'offsets': offsets, 'infos': infos}
+
+    return {'version': VERSION, 'start': start, 'end': end, 'zones': zones}
+
+
+def write(path, data):
+    '''Atomically write table data to a file'''
+    dirname = os.path.dirname(path) or '.'
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wt') as tfile:
+            json.dump(data, tfile, separators=(',', ':'), sort_keys=True)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
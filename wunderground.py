@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
 import datetime
-import requests
+import endpoints
+import transport
 
 FORECAST_URL = 'http://www.wunderground.com/cgi-bin/findweather/' \
                'getForecast'
-API_TEMPLATE = 'http://api.wunderground.com/api/{}'
-api = None
+API_TEMPLATE = '{}/api/{}'
+AUTOCOMPLETE_TEMPLATE = '{}/aq'
+# the parts of a forecast the workflow uses
+FIELDS = ('response', 'current_observation', 'forecast.simpleforecast',
+          'moon_phase', 'alerts')
+key = None
 
 
 class WeatherException(Exception):
@@ -15,9 +20,13 @@ class WeatherException(Exception):
         self.error = error
 
 
-def set_key(key):
-    global api
-    api = API_TEMPLATE.format(key)
+def set_key(api_key):
+    global key
+    key = api_key
+
+
+def get_api():
+    return API_TEMPLATE.format(endpoints.url('wunderground'), key)
 
 
 def get_forecast_url(location, date=None):
@@ -30,26 +39,62 @@ def get_forecast_url(location, date=None):
     return url
 
 
-def forecast(location):
+def forecast(location, fields=FIELDS):
     '''
     Get the current conditions and a 4-day forecast for a location
 
     The location may be 'latitude,longitude' (-39.452,18.234), a US ZIP code,
-    or a 'state/city' path like 'OH/Fairborn' or 'NY/New_York'.
+    or a 'state/city' path like 'OH/Fairborn' or 'NY/New_York'. Only the
+    given dotted paths are decoded from the response; use fields=None to get
+    the complete forecast.
+    '''
+    return fetch(location, fields).data
+
+
+def fetch(location, fields=FIELDS, validators=None):
+    '''
+    Get a forecast like forecast(), but only if it has changed since the
+    response some validators came from. Returns a transport.Fetched whose
+    data is None if it hasn't.
     '''
     url = '{}/conditions/alerts/astronomy/forecast10day/q/{}.json'.format(
-        api, location)
-    r = requests.get(url).json()
-    if 'error' in r['response']:
-        raise WeatherException('Your key is invalid or wunderground is down',
-                               r['response']['error'])
-    return r
+        get_api(), location)
+    headers = transport.conditional_headers(url, validators=validators)
+    r = transport.get(url, headers=headers, stream=fields is not None)
+    try:
+        if r.status_code == 304:
+            return transport.Fetched(None,
+                                     transport.validators(r, validators))
+
+        data = transport.read_json(r, fields)
+        if 'error' in data['response']:
+            raise WeatherException('Your key is invalid or wunderground is '
+                                   'down', data['response']['error'])
+        return transport.Fetched(data, transport.validators(r))
+    finally:
+        r.close()
 
 
 def autocomplete(query):
     '''Return autocomplete values for a query'''
-    url = 'http://autocomplete.wunderground.com/aq?query={}'.format(query)
-    return requests.get(url).json()['RESULTS']
+    url = AUTOCOMPLETE_TEMPLATE.format(endpoints.url('autocomplete'))
+    return transport.get(url, params={'query': query}).json()['RESULTS']
+
+
+def forecast_async(location, deadline=None):
+    '''Start getting a forecast; returns a transport.Future'''
+    return transport.submit(forecast, location, deadline=deadline)
+
+
+def fetch_async(location, validators=None, deadline=None):
+    '''Start a conditional forecast request; returns a transport.Future'''
+    return transport.submit(fetch, location, validators=validators,
+                            deadline=deadline)
+
+
+def autocomplete_async(query, deadline=None):
+    '''Start getting autocomplete values; returns a transport.Future'''
+    return transport.submit(autocomplete, query, deadline=deadline)
 
 
 if __name__ == '__main__':